@@ -1,6 +1,7 @@
-from .rtttl import Ringtone
+from .rtttl import Ringtone, DEFAULT_TONES
 from .handheld import Handheld
 from .driver import Driver
+from .fleet import Fleet
 from .connection import Service, HandheldManager, HandheldConnectData
 
 
@@ -10,7 +11,7 @@ from .logging import logger
 
 __all__ = [
     "Handheld",
-    "Driver",
+    "Driver", "Fleet",
     "Service", "HandheldManager", "HandheldConnectData",
-    "Ringtone",
+    "Ringtone", "DEFAULT_TONES",
 ]
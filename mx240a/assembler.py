@@ -0,0 +1,105 @@
+from time import monotonic
+from typing import Dict, Tuple, Optional, List, Final
+
+from mx240a.logging import logger
+from mx240a.packets import MessagePacket
+
+
+class _PartialMessage:
+    buffer: bytearray
+    length: int
+    last_fragment: float
+    overflowed: bool
+
+    def __init__(self, buffer: bytearray) -> None:
+        self.buffer = buffer
+        self.length = 0
+        self.last_fragment = 0.0
+        self.overflowed = False
+
+
+class MessageAssembler:
+    """
+    Reassembles chat messages that arrive from the handhelds as several fragments
+
+    Every (connection, window) pair gets its own buffer, so handhelds typing at the same time do not mix their messages.
+
+    max_size: longest message accepted, longer messages are dropped
+    timeout: seconds a partial message may wait for its next fragment before it is dropped
+    """
+    max_size: int
+    timeout: float
+
+    DEFAULT_MAX_SIZE: Final[int] = 1024
+    DEFAULT_TIMEOUT: Final[float] = 30.0
+
+    def __init__(self, max_size: int = DEFAULT_MAX_SIZE, timeout: float = DEFAULT_TIMEOUT) -> None:
+        self.max_size = max_size
+        self.timeout = timeout
+        self._partials: Dict[Tuple[int, int], _PartialMessage] = {}
+        self._free_buffers: List[bytearray] = []
+
+    def feed(self, packet: MessagePacket, now: Optional[float] = None) -> Optional[bytes]:
+        """
+        Add a fragment
+
+        :param packet: the fragment
+        :param now: the current time, from time.monotonic()
+        :return: the complete message if this fragment finished one, otherwise None
+        """
+        key = (packet.connection_id, packet.window_id)
+        partial = self._partials.get(key)
+        if partial is None:
+            partial = self._partials[key] = _PartialMessage(self._get_buffer())
+        partial.last_fragment = monotonic() if now is None else now
+
+        data = packet.data
+        end = partial.length + len(data)
+        if partial.overflowed or end > self.max_size:
+            if not partial.overflowed:
+                logger.warning(f"Message from handheld {packet.connection_id} window {packet.window_id} "
+                               f"is over {self.max_size} bytes, dropping it")
+            partial.overflowed = True
+        else:
+            partial.buffer[partial.length:end] = data
+            partial.length = end
+
+        if not packet.final:
+            return None
+
+        del self._partials[key]
+        self._free_buffers.append(partial.buffer)
+        if partial.overflowed:
+            return None
+        return bytes(partial.buffer[:partial.length])
+
+    def expire(self, now: Optional[float] = None) -> None:
+        """
+        Drop partial messages that have waited too long for their next fragment
+
+        :param now: the current time, from time.monotonic()
+        """
+        if not self._partials:
+            return
+        deadline = (monotonic() if now is None else now) - self.timeout
+        for key, partial in list(self._partials.items()):
+            if partial.last_fragment < deadline:
+                logger.warning(f"Timed out waiting for the rest of a message from handheld {key[0]} window {key[1]}")
+                self._drop(key)
+
+    def drop_connection(self, connection_id: int) -> None:
+        """
+        Drop all partial messages from a connection
+
+        :param connection_id: the connection
+        """
+        for key in [k for k in self._partials if k[0] == connection_id]:
+            self._drop(key)
+
+    def _drop(self, key: Tuple[int, int]) -> None:
+        self._free_buffers.append(self._partials.pop(key).buffer)
+
+    def _get_buffer(self) -> bytearray:
+        if self._free_buffers:
+            return self._free_buffers.pop()
+        return bytearray(self.max_size)
@@ -1,37 +1,77 @@
-from threading import Lock, Thread, Event
-from time import sleep
-from typing import Optional
+from threading import Lock
+from time import sleep, monotonic
+from typing import Optional, List, Final
 
 # noinspection PyPep8Naming
-from hid import device as HIDDevice
+from hid import device as HIDDevice, enumerate as hid_enumerate
 
 from mx240a.logging import logger
 from mx240a.util import to_hex, hexdump
 from mx240a.packets import Packet, BaseInitPacket, BaseShutdownPacket, BaseInitReplyPacket
 
 
+class BaseDisconnectedError(OSError):
+    """The base stopped responding, it was probably unplugged or reset"""
+
+
 class Base:
     write_lock: Lock
     read_lock: Lock
     device: Optional[HIDDevice]
-
-    def __init__(self) -> None:
+    path: Optional[bytes]
+    # seconds from opening the device to the init reply, for the last open
+    time_to_ready: Optional[float]
+    init_attempts: int
+    init_timeout_ms: int
+
+    VENDOR_ID: Final[int] = 0x22b8
+    PRODUCT_ID: Final[int] = 0x7f01
+    MANUFACTURER: Final[str] = "Giant Wireless Technology"
+    PRODUCT: Final[str] = "MX240a MOTOROLA MESSENGER"
+
+    INIT_ATTEMPTS: Final[int] = 4
+    INIT_TIMEOUT_MIN_MS: Final[int] = 200
+    INIT_TIMEOUT_MAX_MS: Final[int] = 2000
+    # frames read at most while draining what the base queued before it was opened
+    MAX_DRAIN_FRAMES: Final[int] = 256
+
+    def __init__(self, path: Optional[bytes] = None) -> None:
+        """
+        :param path: hid path of the base to open, from Base.enumerate(). None opens the first base found
+        """
         self.device = None
+        self.path = path
+        self.time_to_ready = None
+        self.init_attempts = 0
+        # adapted to how fast the base actually replies
+        self.init_timeout_ms = 500
         self.write_lock = Lock()
         self.read_lock = Lock()
 
         self._open()
 
-    def _open_dev(self) -> bool:
-        vendor_id = 0x22b8
-        product_id = 0x7f01
+    @staticmethod
+    def enumerate() -> List[bytes]:
+        """
+        Find every attached base
+
+        :return: the hid path of each base, in a stable order
+        """
+        return sorted(
+            info["path"] for info in hid_enumerate(Base.VENDOR_ID, Base.PRODUCT_ID)
+            if info.get("manufacturer_string") == Base.MANUFACTURER and info.get("product_string") == Base.PRODUCT
+        )
 
+    def _open_dev(self) -> bool:
         self.device = device = HIDDevice()
         try:
-            device.open(vendor_id, product_id)
+            if self.path is None:
+                device.open(Base.VENDOR_ID, Base.PRODUCT_ID)
+            else:
+                device.open_path(self.path)
             mfr = device.get_manufacturer_string()
             prd = device.get_product_string()
-            if mfr == "Giant Wireless Technology" and prd == "MX240a MOTOROLA MESSENGER":
+            if mfr == Base.MANUFACTURER and prd == Base.PRODUCT:
                 return True
         except IOError as e:
             logger.error(e)
@@ -39,34 +79,52 @@ class Base:
 
         return False
 
-    def _open_init_dev(self) -> bool:
+    def _drain(self) -> int:
+        """
+        Throw away everything the base has queued, like frames from the previous session
+
+        :return: number of frames dropped
+        """
+        dropped = 0
+        with self.read_lock:
+            try:
+                while dropped < Base.MAX_DRAIN_FRAMES and self.device.read(255, 0):
+                    dropped += 1
+            except OSError as e:
+                raise BaseDisconnectedError(f"Read failed: {e}") from e
+        if dropped:
+            logger.debug(f"Dropped {dropped} stale frames")
+        return dropped
+
+    def _open_init_dev(self, timeout_ms: int) -> Optional[float]:
+        """
+        Send the init packet and wait for the reply, returning as soon as it arrives
+
+        :param timeout_ms: how long to wait for the reply
+        :return: seconds the reply took, None if it did not come
+        """
         self.write(BaseInitPacket())
+        sent = monotonic()
+        deadline = sent + timeout_ms / 1000
 
-        stop_event = Event()
-        error = Event()
-
-        def _wait_init_reply() -> None:
-            while not stop_event.is_set():
-                packet = self.read()
-                if packet and isinstance(packet, BaseInitReplyPacket):
-                    logger.trace(f"Got init reply: {packet}")
-                    break
-                elif packet:
-                    error.set()
-                    logger.debug(f"Got packet but not init reply: {packet}")
-                    break
-
-        wait = Thread(target=_wait_init_reply)
-        wait.start()
-        wait.join(2)
-        if wait.is_alive() or error.is_set():
-            stop_event.set()
-            wait.join()
-            return False
-        return True
+        while (remaining := deadline - monotonic()) > 0:
+            try:
+                packet = self.read(max(1, int(remaining * 1000)))
+            except BaseDisconnectedError as e:
+                logger.debug(e)
+                return None
+            if isinstance(packet, BaseInitReplyPacket):
+                logger.trace(f"Got init reply: {packet}")
+                return monotonic() - sent
+            elif packet:
+                # left over from before the drain, the reply can still come
+                logger.debug(f"Got packet but not init reply: {packet}")
+        return None
 
     def _open(self) -> None:
-        logger.info("Opening base")
+        logger.info("Opening base" if self.path is None else f"Opening base {self.path!r}")
+        start = monotonic()
+        self.time_to_ready = None
         if not self._open_dev():
             raise RuntimeError("Unable to open base")
 
@@ -74,38 +132,63 @@ class Base:
         logger.debug(f"prd: {self.device.get_product_string()}")
 
         logger.debug("Initializing base")
-        retries = 0
-        while retries < 3:
-            if not self._open_init_dev():
-                self.write(BaseShutdownPacket())
-                sleep(0.5)
-                retries += 1
-            else:
+        self._drain()
+
+        timeout_ms = self.init_timeout_ms
+        for attempt in range(1, Base.INIT_ATTEMPTS + 1):
+            self.init_attempts = attempt
+            latency = self._open_init_dev(timeout_ms)
+            if latency is not None:
                 break
+            self.write(BaseShutdownPacket())
+            # give the base a moment to shut down, then drop whatever it sent meanwhile
+            sleep(0.05)
+            self._drain()
+            timeout_ms = min(timeout_ms * 2, Base.INIT_TIMEOUT_MAX_MS)
         else:
             raise RuntimeError("Failed to initialize base")
-        logger.debug("Init success")
+
+        # next time, wait a bit more than this reply took
+        latency_ms = int(latency * 1000)
+        self.init_timeout_ms = max(Base.INIT_TIMEOUT_MIN_MS, min(latency_ms * 2, Base.INIT_TIMEOUT_MAX_MS))
+        self.time_to_ready = monotonic() - start
+        logger.debug(f"Init success in {self.time_to_ready * 1000:.0f}ms, {self.init_attempts} attempts")
 
     def _close(self) -> None:
         logger.info("Base shutting down")
-        self.write(BaseShutdownPacket())
+        try:
+            self.write(BaseShutdownPacket())
+        except OSError:
+            # already gone
+            pass
         self.device.close()
 
     def close(self) -> None:
         self._close()
 
-    def _read(self) -> Optional[Packet]:
+    def reopen(self) -> None:
+        """
+        Open and initialize the base again, after a BaseDisconnectedError
+
+        Raises RuntimeError if the base is not back yet
+        """
+        try:
+            self.device.close()
+        except OSError:
+            pass
+        self._open()
+
+    def _read(self, timeout_ms: int = 1000) -> Optional[Packet]:
         with self.read_lock:
             try:
-                # 255 bytes max, 1 second timeout
-                data = bytes(self.device.read(255, 1000))
+                # 255 bytes max
+                data = bytes(self.device.read(255, timeout_ms))
+                if len(data):
+                    while 0xff not in data and 0xfe not in data:
+                        data += bytes(self.device.read(-1))
             except OSError as e:
-                logger.warning(e)
-                data = bytes()
-                pass
+                raise BaseDisconnectedError(f"Read failed: {e}") from e
             if len(data):
-                while 0xff not in data and 0xfe not in data:
-                    data += bytes(self.device.read(-1))
                 # todo: check if this breaks anything
                 data = data.split(b"\xff")[0]
                 logger.trace(f"[RECV] {hexdump(data)}")
@@ -113,8 +196,8 @@ class Base:
                 return packet
             return None
 
-    def read(self) -> Optional[Packet]:
-        return self._read()
+    def read(self, timeout_ms: int = 1000) -> Optional[Packet]:
+        return self._read(timeout_ms)
 
     def _write(self, data: bytes) -> None:
         with self.write_lock:
@@ -129,10 +212,23 @@ class Base:
             # write and count amount written
             for part in parts:
                 logger.trace(f"[SEND] {hexdump(part)}")
-                self.device.write(part)
+                try:
+                    written = self.device.write(part)
+                except OSError as e:
+                    raise BaseDisconnectedError(f"Write failed: {e}") from e
+                if written < 0:
+                    raise BaseDisconnectedError("Write failed")
                 # todo test how much to delay
                 sleep(0.15)
 
     def write(self, packet: Packet) -> None:
         for data in packet.encode():
             self._write(data)
+
+    def write_frame(self, data: bytes) -> None:
+        """
+        Write a single encoded frame, for callers that interleave the frames of a packet with other traffic
+
+        :param data: one frame from Packet.encode()
+        """
+        self._write(data)
@@ -0,0 +1,123 @@
+import codecs
+from typing import Dict, Final, Tuple, Optional
+
+# the handheld's character set, registered with python's codecs as "mx240a"
+# 0x20 - 0x7e is plain ascii, 0x00 - 0x1f show the glyphs listed in protocol/group_usernames.txt
+CODEC_NAME: Final[str] = "mx240a"
+
+_UNDEFINED: Final[str] = "\ufffe"
+
+# byte -> displayed glyph, from protocol/group_usernames.txt
+# 0x0a shows a j in a username, but it is the line feed mx240a.layout breaks message lines on, so it decodes to one
+_LOW_GLYPHS: Final[str] = "`abcdefghi\nklmnopqrstuvwxyz{|}~ "
+
+DECODING_TABLE: Final[str] = (
+    _LOW_GLYPHS
+    + "".join(chr(b) for b in range(0x20, 0x7f))
+    + _UNDEFINED * (0x100 - 0x7f)
+)
+
+# extra characters accepted when encoding, line feeds are passed through for mx240a.layout, which never sends them
+# in username fields 0x21, 0x22, 0x25 and 0x27 show arrows and box corners instead of ! " % ', they are left out
+# here so chat text round trips, mx240a.translit turns arrows into ascii
+_ENCODE_ALIASES: Final[Dict[str, int]] = {
+    "\n": 0x0a,
+    "\t": 0x20,
+}
+
+ENCODING_MAP: Final[Dict[int, int]] = {
+    **{b: b for b in range(0x20, 0x7f)},
+    **{ord(c): b for c, b in _ENCODE_ALIASES.items()},
+}
+
+# fast path tables: everything that can be encoded / decoded maps into ascii, everything else maps out of it
+_ENCODE_TRANSLATE: Final[Dict[int, str]] = {
+    **{c: _UNDEFINED for c in range(0x80) if c not in ENCODING_MAP},
+    **{c: chr(b) for c, b in ENCODING_MAP.items()},
+}
+_DECODE_TRANSLATE: Final[bytes] = bytes(
+    ord(c) if c != _UNDEFINED else 0x80 for c in DECODING_TABLE
+)
+
+
+def encode(text: str, errors: str = "strict") -> Tuple[bytes, int]:
+    """
+    Encode a string to the handheld's character set
+
+    :param text: the string
+    :param errors: how to handle characters the handheld cannot show, same as str.encode
+    :return: the encoded bytes and the number of characters consumed
+    """
+    translated = text.translate(_ENCODE_TRANSLATE)
+    if translated.isascii():
+        return translated.encode("ascii"), len(text)
+    try:
+        return codecs.charmap_encode(text, errors, ENCODING_MAP)
+    except UnicodeEncodeError as e:
+        e.encoding = CODEC_NAME
+        raise
+
+
+def decode(data: bytes, errors: str = "strict") -> Tuple[str, int]:
+    """
+    Decode bytes in the handheld's character set
+
+    :param data: the bytes
+    :param errors: how to handle bytes with no known glyph, same as bytes.decode
+    :return: the decoded string and the number of bytes consumed
+    """
+    data = bytes(data)
+    translated = data.translate(_DECODE_TRANSLATE)
+    if translated.isascii():
+        return translated.decode("ascii"), len(data)
+    try:
+        return codecs.charmap_decode(data, errors, DECODING_TABLE)
+    except UnicodeDecodeError as e:
+        e.encoding = CODEC_NAME
+        raise
+
+
+class Codec(codecs.Codec):
+    def encode(self, text: str, errors: str = "strict") -> Tuple[bytes, int]:
+        return encode(text, errors)
+
+    def decode(self, data: bytes, errors: str = "strict") -> Tuple[str, int]:
+        return decode(data, errors)
+
+
+class IncrementalEncoder(codecs.IncrementalEncoder):
+    def encode(self, text: str, final: bool = False) -> bytes:
+        return encode(text, self.errors)[0]
+
+
+class IncrementalDecoder(codecs.IncrementalDecoder):
+    def decode(self, data: bytes, final: bool = False) -> str:
+        return decode(data, self.errors)[0]
+
+
+class StreamWriter(Codec, codecs.StreamWriter):
+    pass
+
+
+class StreamReader(Codec, codecs.StreamReader):
+    pass
+
+
+_CODEC_INFO: Final[codecs.CodecInfo] = codecs.CodecInfo(
+    name=CODEC_NAME,
+    encode=encode,
+    decode=decode,
+    incrementalencoder=IncrementalEncoder,
+    incrementaldecoder=IncrementalDecoder,
+    streamwriter=StreamWriter,
+    streamreader=StreamReader,
+)
+
+
+def _search(name: str) -> Optional[codecs.CodecInfo]:
+    if name.replace("-", "_") == CODEC_NAME:
+        return _CODEC_INFO
+    return None
+
+
+codecs.register(_search)
@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import Union, Optional, Dict
+from typing import Union, Optional, Dict, Callable, List
 
 import mx240a
 
@@ -10,9 +10,13 @@ class HandheldConnectData:
 
     handheld_name: the name displayed on / identifying the handheld
     tones: the ringtones for various events on the handheld
+    force_tone_refresh: upload all tones, even ones the handheld should already have
+    service: the service for this handheld, None for the driver's default service
     """
     handheld_name: str
     tones: "_Ringtones"
+    force_tone_refresh: bool
+    service: Optional["Service"]
 
     class _Ringtones:
         """
@@ -56,6 +60,8 @@ class HandheldConnectData:
     def __init__(self, handheld_name: str) -> None:
         self.handheld_name = handheld_name
         self.tones = self._Ringtones()
+        self.force_tone_refresh = False
+        self.service = None
 
 
 class HandheldManager(ABC):
@@ -85,6 +91,24 @@ class HandheldManager(ABC):
         # todo: return connect error instead of none
         raise NotImplementedError
 
+    def add_change_callback(self, callback: Callable[[Optional[str]], None]) -> None:
+        """
+        Register a function to call when data_changed is called
+
+        :param callback: called with the handheld id, or None for all handhelds
+        """
+        callbacks: List[Callable[[Optional[str]], None]] = self.__dict__.setdefault("_change_callbacks", [])
+        callbacks.append(callback)
+
+    def data_changed(self, handheld_id: Optional[str] = None) -> None:
+        """
+        Call when the data connect() returns for a handheld has changed, so cached handshakes are rebuilt
+
+        :param handheld_id: the handheld, or None for all handhelds
+        """
+        for callback in self.__dict__.get("_change_callbacks", []):
+            callback(handheld_id)
+
 
 class Service(ABC):
     """Class to represent a "chat service" to the handheld"""
@@ -111,3 +135,31 @@ class Service(ABC):
         """
         # todo: return login error instead of bool
         raise NotImplementedError
+
+    def message(self, handheld: mx240a.Handheld, window_id: int, message: str) -> None:
+        """
+        Called when a handheld sends a chat message
+
+        :param handheld: the handheld
+        :param window_id: the window the message was typed in
+        :param message: the message
+        """
+        pass
+
+    def window_opened(self, handheld: mx240a.Handheld, window: "mx240a.handheld.Window") -> None:
+        """
+        Called when a handheld opens a buddy or room window
+
+        :param handheld: the handheld
+        :param window: the window
+        """
+        pass
+
+    def window_closed(self, handheld: mx240a.Handheld, window: "mx240a.handheld.Window") -> None:
+        """
+        Called when a handheld closes a window
+
+        :param handheld: the handheld
+        :param window: the window
+        """
+        pass
@@ -1,35 +1,140 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from queue import SimpleQueue, Empty
+from threading import Event, Lock
 from time import monotonic
-from typing import Type, Dict, Callable, TypeVar, Final, Optional
+from asyncio import AbstractEventLoop
+from typing import Type, Dict, Callable, Final, Optional, Deque, Tuple, List, Any, Iterable
 
-from mx240a.connection import Service, HandheldManager
-from mx240a.base import Base
+from mx240a.connection import Service, HandheldManager, HandheldConnectData
+from mx240a.base import Base, BaseDisconnectedError
 from mx240a.packets import Packet, HandheldConnectingPacket, HandheldDisconnectedPacket, \
-    HandheldInfoPacket, ServiceInfoPacket, PollingPacket, RingtonePacket, HandheldUsernamePacket, \
-    HandheldPasswordPacket, ErrorPacket, LoginSuccessPacket
+    PollingPacket, HandheldUsernamePacket, HandheldPasswordPacket, ErrorPacket, LoginSuccessPacket, MessagePacket, \
+    SendMessagePacket, OpenWindowPacket, CloseWindowPacket, TxPacket
+from mx240a.assembler import MessageAssembler
+from mx240a.events import EventBus
+from mx240a.charset import CODEC_NAME
 from mx240a.logging import logger
-from mx240a.handheld import Handheld
-from mx240a.rtttl import Ringtone
+from mx240a.handheld import Handheld, BuddyStatus
+from mx240a.handshake import HandshakeCache
+from mx240a.presence import PresenceDebouncer
+from mx240a.tonestate import ToneStateStore
 
-PacketInstanceType = TypeVar("PacketInstanceType", bound="Packet")
+
+class _ToneUpload:
+    """Tones waiting to be uploaded to a handheld in the background"""
+    handheld_id: str
+    tones: Deque[Tuple[str, bytes, List[bytes]]]
+    frame_index: int
+
+    def __init__(self, handheld_id: str) -> None:
+        self.handheld_id = handheld_id
+        self.tones = deque()
+        self.frame_index = 0
+
+
+class _Outgoing:
+    """An encoded packet waiting in the outbox to be written by the driver thread"""
+    connection_id: int
+    frames: List[bytes]
+    future: Future
+    result: Any
+    running: bool
+
+    def __init__(self, connection_id: int, frames: List[bytes], future: Future, result: Any) -> None:
+        self.connection_id = connection_id
+        self.frames = frames
+        self.future = future
+        self.result = result
+        self.running = False
+
+
+class _PendingCall:
+    """A HandheldManager or Service callback running on the worker pool"""
+    handheld: Handheld
+    future: Future
+    deadline: float
+    on_result: Callable[[Handheld, Any], None]
+    error: ErrorPacket.ErrorType
+
+    def __init__(self, handheld: Handheld, future: Future, deadline: float, on_result: Callable[[Handheld, Any], None],
+                 error: ErrorPacket.ErrorType) -> None:
+        self.handheld = handheld
+        self.future = future
+        self.deadline = deadline
+        self.on_result = on_result
+        self.error = error
 
 
 class Driver:
     base: Base
-    PACKET_DISPATCH_TABLE: Final[Dict[Type[Packet], Callable[[PacketInstanceType], None]]]
+    base_index: int
+    stop_event: Event
+    events: EventBus
     num_connections: int
     connections: Dict[int, Optional[Handheld]]
     last_time: int
     ping_timer: int
     service: Service
+    assembler: MessageAssembler
+    tone_state: ToneStateStore
+    pending_tones: Dict[int, _ToneUpload]
+    tone_uploads: Dict[int, _ToneUpload]
+    handshakes: HandshakeCache
+    outbox: "SimpleQueue[_Outgoing]"
+    callback_pool: ThreadPoolExecutor
+    service_pools: Dict[Service, ThreadPoolExecutor]
+    # Service notifications waiting behind the one running for their handheld
+    notifications: Dict[Handheld, Deque[Tuple[Callable[..., None], Tuple[Any, ...]]]]
+    notifications_lock: Lock
+    # the last session of each handheld, its buddy list is still on the handheld when it reconnects
+    last_sessions: Dict[str, Handheld]
+    presence: PresenceDebouncer
+    # packets taken from the outbox that still have to be written, ahead of the outbox
+    requeued: Deque[_Outgoing]
+    # handhelds that were connected when the base was lost, by connection id, and when to give up on them
+    resuming: Dict[int, Handheld]
+    resume_deadline: float
+    pending_calls: List[_PendingCall]
 
-    def __init__(self, handheld_manager: HandheldManager, service: Service) -> None:
-        self.base = Base()
-        self.PACKET_DISPATCH_TABLE = {
-            HandheldConnectingPacket: self.handle_connection_packet,
-            HandheldDisconnectedPacket: self.handle_disconnect_packet,
-            HandheldUsernamePacket: self.handle_username_packet,
-            HandheldPasswordPacket: self.handle_password_packet,
-        }
+    IDLE_READ_TIMEOUT_MS: Final[int] = 1000
+    # short enough to keep background uploads moving and outgoing messages prompt,
+    # long enough to notice user traffic first
+    BUSY_READ_TIMEOUT_MS: Final[int] = 50
+    CALLBACK_WORKERS: Final[int] = 4
+    # keeps addresses in one byte
+    MAX_BASE_INDEX: Final[int] = 31
+    REOPEN_BACKOFF_S: Final[Tuple[float, ...]] = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0)
+    # how long handhelds get to come back after the base was reopened
+    RESUME_TIMEOUT_S: Final[float] = 60.0
+    # how long HandheldManager.connect and Service.login get before the handheld is sent an error
+    CONNECT_DEADLINE_S: Final[float] = 5.0
+    LOGIN_DEADLINE_S: Final[float] = 10.0
+
+    def __init__(self, handheld_manager: HandheldManager, service: Service,
+                 tone_state_path: Optional[str] = None, base_path: Optional[bytes] = None, base_index: int = 0,
+                 tone_state: Optional[ToneStateStore] = None) -> None:
+        """
+        :param handheld_manager: manages registering and connecting handhelds
+        :param service: the default chat service, HandheldConnectData.service can pick another per handheld
+        :param tone_state_path: file to remember uploaded tones in across restarts, None to only remember in memory
+        :param base_path: hid path of the base to drive, None for the first one found
+        :param base_index: number of this base when driving several, see address()
+        :param tone_state: a tone state store shared with other drivers, instead of tone_state_path
+        """
+        if base_index < 0 or base_index > Driver.MAX_BASE_INDEX:
+            raise ValueError(f"Invalid base_index {base_index}")
+        self.base = Base(base_path)
+        self.base_index = base_index
+        self.stop_event = Event()
+        self.events = EventBus()
+        self.events.subscribe(HandheldConnectingPacket, self.handle_connection_packet)
+        self.events.subscribe(HandheldDisconnectedPacket, self.handle_disconnect_packet)
+        self.events.subscribe(HandheldUsernamePacket, self.handle_username_packet)
+        self.events.subscribe(HandheldPasswordPacket, self.handle_password_packet)
+        self.events.subscribe(MessagePacket, self.handle_message_packet)
+        self.events.subscribe(OpenWindowPacket, self.handle_open_window_packet)
+        self.events.subscribe(CloseWindowPacket, self.handle_close_window_packet)
         self.num_connections = 0
         self.connections = {
             1: None,
@@ -44,14 +149,52 @@ class Driver:
         self.ping_timer = 0
         self.service = service
         self.handheld_manager = handheld_manager
+        self.assembler = MessageAssembler()
+        self.tone_state = tone_state if tone_state is not None else ToneStateStore(tone_state_path)
+        # tones waiting for their handheld to log in, and tones being uploaded
+        self.pending_tones = {}
+        self.tone_uploads = {}
+        self.handshakes = HandshakeCache()
+        # packets from other threads, only the driver thread touches the base
+        self.outbox = SimpleQueue()
+        # manager and service callbacks can be slow, they run here so the link keeps moving
+        self.callback_pool = ThreadPoolExecutor(Driver.CALLBACK_WORKERS, thread_name_prefix="mx240a-callback")
+        # each service's callbacks run on its own pool, a slow backend doesn't hold up the others
+        self.service_pools = {}
+        self.notifications = {}
+        self.notifications_lock = Lock()
+        self.pending_calls = []
+        self.last_sessions = {}
+        self.presence = PresenceDebouncer()
+        self.requeued = deque()
+        self.resuming = {}
+        self.resume_deadline = 0.0
+        handheld_manager.add_change_callback(self.invalidate_handshake)
+
+    def address(self, connection_id: int) -> int:
+        """
+        :param connection_id: a connection on this driver's base
+        :return: the connection's address, unique across bases: (base_index << 3) | connection_id
+        """
+        return (self.base_index << 3) | connection_id
+
+    def stop(self) -> None:
+        """Make loop() return after its current iteration, safe to call from any thread"""
+        self.stop_event.set()
 
     def loop(self) -> None:
         try:
-            while True:
-                self.do_one_loop()
+            while not self.stop_event.is_set():
+                try:
+                    self.do_one_loop()
+                except BaseDisconnectedError as e:
+                    self.recover(e)
         except KeyboardInterrupt:
             logger.info("Caught KeyboardInterrupt, exiting...")
         finally:
+            self.callback_pool.shutdown(wait=False)
+            for pool in self.service_pools.values():
+                pool.shutdown(wait=False)
             self.base.close()
 
     def do_one_loop(self) -> None:
@@ -59,8 +202,19 @@ class Driver:
         delta = cur_time - self.last_time
         self.last_time = cur_time
 
-        if packet := self.base.read():
+        busy = self.tone_uploads or self.num_connections or self.pending_calls
+        if self.num_connections and self.presence:
+            self.flush_presence()
+        timeout = Driver.BUSY_READ_TIMEOUT_MS if busy else Driver.IDLE_READ_TIMEOUT_MS
+        if packet := self.base.read(timeout):
             self.process_packet(packet)
+        elif not self.flush_outbox() and self.tone_uploads:
+            # only upload tones while the link is otherwise idle
+            self.continue_tone_upload()
+        if self.pending_calls:
+            self.poll_callbacks()
+        if self.resuming and monotonic() > self.resume_deadline:
+            self.expire_resuming()
 
         self.ping_timer += delta
         time_limit = 500 if self.num_connections else 3000
@@ -68,13 +222,82 @@ class Driver:
             assert self.num_connections >= 0
             self.ping_timer = 0
             self.base.write(PollingPacket())
+            self.assembler.expire()
 
     def process_packet(self, packet: Packet) -> None:
         logger.trace(f"[RECV] Packet {packet}")
-        try:
-            self.PACKET_DISPATCH_TABLE[type(packet)](packet)
-        except KeyError:
-            logger.error(f"No handler for packet type {type(packet).__name__}")
+        if self.resuming and not isinstance(packet, HandheldConnectingPacket):
+            # a handheld that talks without connecting again kept its connection through the reset
+            if (handheld := self.resuming.pop(getattr(packet, "connection_id", 0), None)) is not None:
+                self._resume(handheld)
+        self.events.publish(packet)
+
+    def recover(self, error: BaseDisconnectedError) -> None:
+        """
+        Reopen the base after it was lost, retrying with backoff until it is back or the driver is stopped
+
+        Sessions are kept: connected handhelds wait in self.resuming to come back, and their queued packets and
+        tones are held for them. A packet that was being written when the base was lost is written again in full.
+        """
+        logger.warning(f"Lost the base: {error}")
+        for connection_id, handheld in self.connections.items():
+            if handheld is not None:
+                self.resuming[connection_id] = handheld
+                self.connections[connection_id] = None
+        self.num_connections = 0
+        for connection_id, upload in self.tone_uploads.items():
+            # the tone being uploaded starts over, it only counts once all of it made it
+            upload.frame_index = 0
+            self.pending_tones[connection_id] = upload
+        self.tone_uploads.clear()
+
+        attempt = 0
+        while not self.stop_event.is_set():
+            try:
+                self.base.reopen()
+                break
+            except (RuntimeError, OSError) as e:
+                delay = Driver.REOPEN_BACKOFF_S[min(attempt, len(Driver.REOPEN_BACKOFF_S) - 1)]
+                logger.debug(f"Base not back yet ({e}), retrying in {delay}s")
+                attempt += 1
+                self.stop_event.wait(delay)
+        else:
+            return
+
+        logger.info(f"Base reopened, waiting for {len(self.resuming)} handhelds to come back")
+        self.resume_deadline = monotonic() + Driver.RESUME_TIMEOUT_S
+        self.ping_timer = 0
+
+    def _resume(self, handheld: Handheld) -> None:
+        connection_id = handheld.connection_id
+        logger.debug(f"Handheld {connection_id} resumed")
+        self.connections[connection_id] = handheld
+        self.num_connections += 1
+        if handheld.connected and (upload := self.pending_tones.pop(connection_id, None)):
+            self.tone_uploads[connection_id] = upload
+
+    def expire_resuming(self) -> None:
+        """Give up on the handhelds that did not come back after the base was reopened"""
+        for connection_id, handheld in self.resuming.items():
+            logger.debug(f"Handheld {connection_id} did not come back")
+            self.connections[connection_id] = handheld
+            self.num_connections += 1
+            self._drop_connection(connection_id)
+        self.resuming.clear()
+
+    def subscribe(self, packet_type: Type[Packet], handler: Callable[[Any], Any],
+                  loop: Optional[AbstractEventLoop] = None) -> Callable[[], None]:
+        """
+        Call a handler for every received packet of a type (or a subclass), after the driver's own handling
+
+        Handlers run on the driver thread, coroutine functions are scheduled on the given event loop instead
+
+        :param packet_type: the packet class, Packet for every packet
+        :param handler: function or coroutine function taking the packet
+        :param loop: the event loop for a coroutine function
+        :return: a function that unsubscribes the handler
+        """
+        return self.events.subscribe(packet_type, handler, loop)
 
     def handle_connection_packet(self, packet: HandheldConnectingPacket) -> None:
         handheld_id = packet.handheld_id
@@ -82,23 +305,76 @@ class Driver:
         logger.debug(f"Handheld {connection_id} connecting, ID: {handheld_id}")
 
         self.num_connections += 1
-        self.connections[connection_id] = Handheld(self, connection_id, handheld_id)
+        resumed = self.resuming.pop(connection_id, None)
+        if resumed is not None and resumed.handheld_id == handheld_id:
+            # connecting again after the base was reset, the session carries on but the handshake starts over
+            for call in self.pending_calls:
+                if call.handheld is resumed:
+                    call.future.cancel()
+            self.pending_calls = [call for call in self.pending_calls if call.handheld is not resumed]
+            handheld = self.connections[connection_id] = resumed
+            handheld.connected = False
+            handheld.password = None
+        else:
+            if resumed is not None:
+                self.last_sessions[resumed.handheld_id] = resumed
+                self.pending_tones.pop(connection_id, None)
+            handheld = self.connections[connection_id] = Handheld(self, connection_id, handheld_id)
+            if previous := self.last_sessions.pop(handheld_id, None):
+                handheld.adopt_buddy_list(previous)
 
-        connect_info = self.handheld_manager.connect(handheld_id)
-        assert connect_info  # todo: error out on null
-        self.base.write(HandheldInfoPacket(connection_id, connect_info.handheld_name))
-        self.base.write(ServiceInfoPacket(connection_id, self.service.service_id))
+        # still asked every time, it decides whether the handheld may connect at all
+        self._call(handheld, self.handheld_manager.connect, handheld_id, on_result=self._finish_connect,
+                   deadline=Driver.CONNECT_DEADLINE_S, error=ErrorPacket.ErrorType.ErrorConnectingToService)
 
-        mute = Ringtone(None)
-        for tone_name, tone in connect_info.tones.as_dict().items():
-            self.base.write(RingtonePacket(connection_id, tone_name, tone if tone else mute))
+    def _finish_connect(self, handheld: Handheld, connect_info: Optional[HandheldConnectData]) -> None:
+        handheld_id = handheld.handheld_id
+        connection_id = handheld.connection_id
+        if not connect_info:
+            logger.debug(f"Handheld {connection_id} not allowed to connect")
+            self.base.write(ErrorPacket(connection_id, ErrorPacket.ErrorType.ErrorConnectingToService))
+            return
+
+        if connect_info.service is not None:
+            handheld.service = connect_info.service
+        script = self.handshakes.get(handheld_id, connection_id, connect_info, handheld.service.service_id)
+        for frame in script.info_frames(connection_id):
+            self.base.write_frame(frame)
+
+        if connect_info.force_tone_refresh:
+            self.tone_state.forget(handheld_id)
+
+        # tones are uploaded in the background once the handheld has logged in
+        upload = _ToneUpload(handheld_id)
+        for tone_name, tone_bytes, frames in script.tones:
+            if not self.tone_state.is_current(handheld_id, tone_name, tone_bytes):
+                upload.tones.append((tone_name, tone_bytes, script.tone_frames(frames, connection_id)))
+        if upload.tones:
+            self.pending_tones[connection_id] = upload
+
+        handheld.connected = True
+        if handheld.password is not None:
+            self._start_login(handheld)
 
     def handle_disconnect_packet(self, packet: HandheldDisconnectedPacket) -> None:
         connection_id = packet.connection_id
         logger.debug(f"Handheld {connection_id} disconnected")
+        if (handheld := self.resuming.pop(connection_id, None)) is not None:
+            self.connections[connection_id] = handheld
+            self.num_connections += 1
+        self._drop_connection(connection_id)
 
+    def _drop_connection(self, connection_id: int) -> None:
         self.num_connections -= 1
+        if handheld := self.connections[connection_id]:
+            self.last_sessions[handheld.handheld_id] = handheld
         self.connections[connection_id] = None
+        self.assembler.drop_connection(connection_id)
+        self.presence.drop_connection(connection_id)
+        self.pending_tones.pop(connection_id, None)
+        if self.tone_uploads.pop(connection_id, None):
+            # keep the tones that did make it, the rest are uploaded on the next connect
+            self.tone_state.save()
 
     def handle_username_packet(self, packet: HandheldUsernamePacket) -> None:
         connection_id = packet.connection_id
@@ -111,10 +387,354 @@ class Driver:
         connection_id = packet.connection_id
         logger.debug(f"Handheld {connection_id} password: \"{packet.password}\"")
         handheld = self.connections[connection_id]
-        if handheld:
-            handheld.password = packet.password
+        if not handheld:
+            return
+        handheld.password = packet.password
+        # the handheld's service is only known once connect() has returned, _finish_connect logs in then
+        if handheld.connected:
+            self._start_login(handheld)
 
-        if self.service.login(handheld):
+    def _start_login(self, handheld: Handheld) -> None:
+        self._call(handheld, handheld.service.login, handheld, pool=self.service_pool(handheld.service),
+                   on_result=self._finish_login,
+                   deadline=Driver.LOGIN_DEADLINE_S, error=ErrorPacket.ErrorType.ServiceTemporarilyUnavailable)
+
+    def _finish_login(self, handheld: Handheld, success: bool) -> None:
+        connection_id = handheld.connection_id
+        if success:
             self.base.write(LoginSuccessPacket(connection_id))
+            if upload := self.pending_tones.pop(connection_id, None):
+                self.tone_uploads[connection_id] = upload
         else:
             self.base.write(ErrorPacket(connection_id, ErrorPacket.ErrorType.ServiceTemporarilyUnavailable))
+
+    def service_pool(self, service: Service) -> ThreadPoolExecutor:
+        """
+        :return: the worker pool for a service's callbacks
+        """
+        pool = self.service_pools.get(service)
+        if pool is None:
+            pool = self.service_pools[service] = ThreadPoolExecutor(
+                Driver.CALLBACK_WORKERS, thread_name_prefix=f"mx240a-{type(service).__name__}")
+        return pool
+
+    def _notify(self, handheld: Handheld, function: Callable[..., None], *args: Any) -> None:
+        """
+        Run a Service notification (message, window_opened, ...) on the service's pool without waiting for it
+
+        Notifications for one handheld run one at a time in the order they were received
+
+        :param handheld: the handheld, passed to the function first
+        :param function: the notification
+        """
+        with self.notifications_lock:
+            queue = self.notifications.get(handheld)
+            if queue is not None:
+                queue.append((function, args))
+                return
+            self.notifications[handheld] = deque()
+        self.service_pool(handheld.service).submit(self._run_notifications, handheld, function, args)
+
+    def _run_notifications(self, handheld: Handheld, function: Callable[..., None], args: Tuple[Any, ...]) -> None:
+        while True:
+            try:
+                function(handheld, *args)
+            except Exception as e:
+                logger.error(f"Service {function.__qualname__} for handheld {handheld.connection_id} failed: {e!r}")
+            with self.notifications_lock:
+                queue = self.notifications[handheld]
+                if not queue:
+                    del self.notifications[handheld]
+                    return
+                function, args = queue.popleft()
+
+    def _call(self, handheld: Handheld, function: Callable[..., Any], *args: Any,
+              on_result: Callable[[Handheld, Any], None], deadline: float, error: ErrorPacket.ErrorType,
+              pool: Optional[ThreadPoolExecutor] = None) -> None:
+        """
+        Run a manager or service callback on a worker pool, on_result is called on the driver thread
+
+        :param handheld: the handheld the call is for, the result is dropped if it disconnects first
+        :param function: the callback
+        :param pool: the pool to run on, defaults to the manager's pool
+        :param on_result: called with the handheld and the callback's result
+        :param deadline: seconds to wait for the callback
+        :param error: error sent to the handheld if the callback fails or misses its deadline
+        """
+        future = (pool or self.callback_pool).submit(function, *args)
+        self.pending_calls.append(_PendingCall(handheld, future, monotonic() + deadline, on_result, error))
+
+    def poll_callbacks(self) -> None:
+        """Finish the manager and service callbacks that are done, and fail the ones past their deadline"""
+        now = monotonic()
+        calls, self.pending_calls = self.pending_calls, []
+        for index, call in enumerate(calls):
+            try:
+                if not self._poll_call(call, now):
+                    self.pending_calls.append(call)
+            except BaseDisconnectedError:
+                # the calls before this one are done, this one is finished again once the handheld is back
+                self.pending_calls.extend(calls[index:])
+                raise
+
+    def _poll_call(self, call: _PendingCall, now: float) -> bool:
+        """
+        :return: True if the call is done with, False to keep waiting for it
+        """
+        handheld = call.handheld
+        connection_id = handheld.connection_id
+        if self.connections[connection_id] is not handheld:
+            if self.resuming.get(connection_id) is handheld:
+                # the base was lost, the result is for when the handheld comes back
+                return False
+            # disconnected, or a different handheld took the connection id
+            call.future.cancel()
+            return True
+
+        if call.future.done():
+            try:
+                result = call.future.result()
+            except Exception as e:
+                logger.error(f"Callback for handheld {connection_id} failed: {e!r}")
+                self.base.write(ErrorPacket(connection_id, call.error))
+                return True
+            try:
+                call.on_result(handheld, result)
+            except BaseDisconnectedError:
+                raise
+            except Exception as e:
+                # a bad result from one handheld's callback must not stop the driver for the others
+                logger.error(f"Finishing callback for handheld {connection_id} failed: {e!r}")
+                self.base.write(ErrorPacket(connection_id, call.error))
+            return True
+        if now > call.deadline:
+            logger.warning(f"Callback for handheld {connection_id} missed its deadline")
+            call.future.cancel()
+            self.base.write(ErrorPacket(connection_id, call.error))
+            return True
+        return False
+
+    def handle_message_packet(self, packet: MessagePacket) -> None:
+        # taken in before the ack, so a fragment is not lost if the base is gone when acking
+        message = self.assembler.feed(packet)
+        if message is not None:
+            connection_id = packet.connection_id
+            text = message.decode(CODEC_NAME, "replace")
+            logger.debug(f"Handheld {connection_id} window {packet.window_id} message: \"{text}\"")
+            handheld = self.connections[connection_id]
+            if handheld:
+                self._notify(handheld, handheld.service.message, packet.window_id, text)
+
+        # ack every fragment right away so the handheld sends the next one
+        self.ping_timer = 0
+        self.base.write(PollingPacket())
+
+    def handle_open_window_packet(self, packet: OpenWindowPacket) -> None:
+        connection_id = packet.connection_id
+        logger.debug(f"Handheld {connection_id} window open: {packet.window_id}")
+        handheld = self.connections[connection_id]
+        if not handheld:
+            return
+        window = handheld.open_window(packet.window_id)
+        if window:
+            self._notify(handheld, handheld.service.window_opened, window)
+        else:
+            logger.warning(f"Handheld {connection_id} opened unknown window {packet.window_id}")
+
+    def handle_close_window_packet(self, packet: CloseWindowPacket) -> None:
+        connection_id = packet.connection_id
+        logger.debug(f"Handheld {connection_id} window close: {packet.window_id}")
+        handheld = self.connections[connection_id]
+        if handheld and (window := handheld.close_window(packet.window_id)):
+            self._notify(handheld, handheld.service.window_closed, window)
+
+    def send_message(self, connection_id: int, window_id: int, text: str,
+                     username: Optional[str] = None) -> Future:
+        """
+        Send a chat message to a window on a handheld, safe to call from any thread
+
+        The packet is built on the calling thread and written by the driver thread, this returns right away
+
+        :param connection_id: the handheld's connection
+        :param window_id: the window to show the message in
+        :param text: the message text
+        :param username: the sender shown in a room window, or the buddy's name for a buddy window
+        :return: a future for the message's Layout, done once the message has been written to the base
+        """
+        packet = SendMessagePacket(connection_id, window_id, text, username)
+        return self._submit(connection_id, list(packet.encode()), packet.layout)
+
+    def send_packet(self, packet: TxPacket, result: Any = None) -> Future:
+        """
+        Send a packet to a handheld, safe to call from any thread
+
+        :param packet: the packet, with a connection_id
+        :param result: the result of the returned future
+        :return: a future, done once the packet has been written to the base
+        """
+        return self._submit(packet.connection_id, list(packet.encode()), result)
+
+    def send_packets(self, connection_id: int, packets: List[TxPacket], result: Any = None) -> Future:
+        """
+        Send packets to a handheld as one batch, written back to back, safe to call from any thread
+
+        :param connection_id: the handheld's connection
+        :param packets: the packets
+        :param result: the result of the returned future
+        :return: a future, done once every packet has been written to the base
+        """
+        return self._submit(connection_id, [frame for packet in packets for frame in packet.encode()], result)
+
+    def broadcast_message(self, recipients: Iterable[Tuple[int, int]], text: str,
+                          username: Optional[str] = None) -> List[Future]:
+        """
+        Send the same chat message to many windows, safe to call from any thread
+
+        The message is laid out and encoded once for buddy windows and once for room windows, each recipient only
+        gets its connection and window id stamped on the shared frames
+
+        :param recipients: (connection_id, window_id) of every window to send to
+        :param text: the message text
+        :param username: the sender shown in room windows, or the buddy's name for buddy windows
+        :return: a future for the message's Layout per recipient, in order
+        """
+        templates: Dict[bool, SendMessagePacket] = {}
+        futures = []
+        for connection_id, window_id in recipients:
+            is_room = window_id > 0x80
+            template = templates.get(is_room)
+            if template is None:
+                template = templates[is_room] = SendMessagePacket(connection_id, window_id, text, username)
+            futures.append(self._submit(connection_id, template.encode_for(connection_id, window_id),
+                                        template.layout))
+        return futures
+
+    def _submit(self, connection_id: int, frames: List[bytes], result: Any = None) -> Future:
+        future: Future = Future()
+        self.outbox.put(_Outgoing(connection_id, frames, future, result))
+        return future
+
+    def flush_outbox(self) -> bool:
+        """
+        Write everything waiting in the outbox, on the driver thread
+
+        :return: if anything was written
+        """
+        wrote = False
+        # packets for handhelds that are still connecting, or yet to come back after a base reset
+        held = []
+        while True:
+            if self.requeued:
+                outgoing = self.requeued.popleft()
+            else:
+                try:
+                    outgoing = self.outbox.get_nowait()
+                except Empty:
+                    break
+
+            if not outgoing.running:
+                if not outgoing.future.set_running_or_notify_cancel():
+                    continue
+                outgoing.running = True
+            handheld = self.connections.get(outgoing.connection_id)
+            if outgoing.connection_id in self.resuming or (handheld is not None and not handheld.connected):
+                held.append(outgoing)
+                continue
+            if handheld is None:
+                outgoing.future.set_exception(RuntimeError(f"Handheld {outgoing.connection_id} is not connected"))
+                continue
+
+            try:
+                for frame in outgoing.frames:
+                    self.base.write_frame(frame)
+            except BaseDisconnectedError:
+                # written again in full once the base is back
+                self.requeued.appendleft(outgoing)
+                self.requeued.extend(held)
+                raise
+            except Exception as e:
+                outgoing.future.set_exception(e)
+                raise
+            outgoing.future.set_result(outgoing.result)
+            wrote = True
+
+        self.requeued.extend(held)
+        return wrote
+
+    def set_buddy_status(self, connection_id: int, screen_name: str, status: BuddyStatus,
+                         mobile: bool = False) -> None:
+        """
+        Report a buddy's status, safe to call from any thread
+
+        Changes are coalesced and rate limited by self.presence, the handheld only gets the net change
+
+        :param connection_id: the handheld's connection
+        :param screen_name: the buddy
+        :param status: the buddy's status
+        :param mobile: if the buddy is on a mobile device
+        """
+        self.presence.update(connection_id, screen_name, status, mobile)
+
+    def flush_presence(self) -> None:
+        """Queue the status updates that are due, skipping the ones that ended up unchanged"""
+        for connection_id, screen_name, status, mobile in self.presence.due():
+            handheld = self.connections[connection_id]
+            if not handheld:
+                self.presence.refund(connection_id)
+                continue
+            # a service may be removing the buddy at the same time
+            with handheld.lock:
+                if not handheld.find_buddy(screen_name) \
+                        or handheld.set_buddy_status(screen_name, status, mobile) is None:
+                    self.presence.refund(connection_id)
+
+    def force_tone_refresh(self, handheld_id: Optional[str] = None) -> None:
+        """
+        Upload all tones to a handheld the next time it connects
+
+        :param handheld_id: the handheld, or None for all handhelds
+        """
+        self.tone_state.forget(handheld_id)
+
+    def forget_buddy_list(self, handheld_id: Optional[str] = None) -> None:
+        """
+        Start from an empty buddy list the next time a handheld connects, for handhelds that lost theirs
+
+        :param handheld_id: the handheld, or None for all handhelds
+        """
+        if handheld_id is None:
+            self.last_sessions.clear()
+        else:
+            self.last_sessions.pop(handheld_id, None)
+
+    def invalidate_handshake(self, handheld_id: Optional[str] = None) -> None:
+        """
+        Rebuild the handshake of a handheld the next time it connects
+
+        Changes to the connect data are noticed anyway, this is for changes made outside of it
+
+        :param handheld_id: the handheld, or None for all handhelds
+        """
+        self.handshakes.invalidate(handheld_id)
+
+    def continue_tone_upload(self) -> None:
+        """Send the next frame of a background tone upload, taking turns between handhelds"""
+        connection_id, upload = next(iter(self.tone_uploads.items()))
+        tone_name, tone_bytes, frames = upload.tones[0]
+        # still in tone_uploads if the base is lost here, so recover() keeps it
+        self.base.write_frame(frames[upload.frame_index])
+        del self.tone_uploads[connection_id]
+        upload.frame_index += 1
+        if upload.frame_index < len(frames):
+            self.tone_uploads[connection_id] = upload
+            return
+
+        # tone done
+        self.tone_state.update(upload.handheld_id, tone_name, tone_bytes)
+        upload.tones.popleft()
+        upload.frame_index = 0
+        if upload.tones:
+            self.tone_uploads[connection_id] = upload
+        else:
+            logger.debug(f"Handheld {connection_id} tone upload done")
+            self.tone_state.save()
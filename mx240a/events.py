@@ -0,0 +1,134 @@
+import asyncio
+import inspect
+from threading import Lock
+from typing import Type, Dict, List, Tuple, Callable, Optional, Any
+
+from mx240a.base import BaseDisconnectedError
+from mx240a.logging import logger
+from mx240a.packets import Packet
+
+Handler = Callable[[Any], Any]
+
+
+class _Subscriber:
+    """A handler, and the event loop to run it on if it is a coroutine function"""
+    handler: Handler
+    loop: Optional[asyncio.AbstractEventLoop]
+
+    def __init__(self, handler: Handler, loop: Optional[asyncio.AbstractEventLoop]) -> None:
+        self.handler = handler
+        self.loop = loop
+
+    def __call__(self, packet: Packet) -> None:
+        if self.loop is None:
+            self.handler(packet)
+        else:
+            asyncio.run_coroutine_threadsafe(self.handler(packet), self.loop)
+
+
+class EventBus:
+    """
+    Dispatches received packets to every handler subscribed to the packet's type or one of its base classes
+
+    Handlers for a packet type are found by walking its MRO once, the result is cached until the subscriptions change,
+    so publishing is a dict lookup and a loop over the handlers. Subscribing is safe from any thread.
+    """
+    _subscribers: Dict[Type[Packet], List[_Subscriber]]
+    _dispatch: Dict[Type[Packet], Tuple[_Subscriber, ...]]
+    _lock: Lock
+
+    def __init__(self) -> None:
+        self._subscribers = {}
+        self._dispatch = {}
+        self._lock = Lock()
+
+    def subscribe(self, packet_type: Type[Packet], handler: Handler,
+                  loop: Optional[asyncio.AbstractEventLoop] = None) -> Callable[[], None]:
+        """
+        Call a handler for every received packet of a type, including subclasses
+
+        Handlers run on the driver thread, coroutine functions are scheduled on their event loop instead
+
+        :param packet_type: the packet class, Packet for every packet
+        :param handler: function or coroutine function taking the packet
+        :param loop: the event loop for a coroutine function
+        :return: a function that unsubscribes the handler
+        """
+        if inspect.iscoroutinefunction(handler):
+            if loop is None:
+                raise ValueError(f"Coroutine handler {handler.__qualname__} needs an event loop")
+        else:
+            loop = None
+
+        subscriber = _Subscriber(handler, loop)
+        with self._lock:
+            subscribers = dict(self._subscribers)
+            subscribers[packet_type] = subscribers.get(packet_type, []) + [subscriber]
+            self._subscribers = subscribers
+            self._dispatch = {}
+
+        def unsubscribe() -> None:
+            self._remove(packet_type, subscriber)
+        return unsubscribe
+
+    def unsubscribe(self, packet_type: Type[Packet], handler: Handler) -> None:
+        """
+        Stop calling a handler for a packet type
+
+        :param packet_type: the packet class it was subscribed with
+        :param handler: the handler
+        """
+        for subscriber in self._subscribers.get(packet_type, []):
+            if subscriber.handler == handler:
+                self._remove(packet_type, subscriber)
+                return
+        raise ValueError(f"{handler} is not subscribed to {packet_type.__name__}")
+
+    def _remove(self, packet_type: Type[Packet], subscriber: _Subscriber) -> None:
+        with self._lock:
+            subscribers = dict(self._subscribers)
+            remaining = [s for s in subscribers.get(packet_type, []) if s is not subscriber]
+            if remaining:
+                subscribers[packet_type] = remaining
+            else:
+                subscribers.pop(packet_type, None)
+            self._subscribers = subscribers
+            self._dispatch = {}
+
+    def _resolve(self, dispatch: Dict[Type[Packet], Tuple[_Subscriber, ...]],
+                 packet_type: Type[Packet]) -> Tuple[_Subscriber, ...]:
+        # dispatch was read before _subscribers, and subscribing replaces _subscribers before _dispatch, so the
+        # subscribers are never older than the cache they are written to
+        subscribers = self._subscribers
+        # most specific class first
+        handlers = tuple(s for cls in packet_type.__mro__ for s in subscribers.get(cls, ()))
+        dispatch[packet_type] = handlers
+        return handlers
+
+    def publish(self, packet: Packet) -> int:
+        """
+        Call every handler subscribed to the packet's type
+
+        An exception in a handler is logged and does not stop the other handlers, except BaseDisconnectedError which
+        is raised so the driver can recover the base
+
+        :param packet: the packet
+        :return: number of handlers called
+        """
+        packet_type = type(packet)
+        dispatch = self._dispatch
+        handlers = dispatch.get(packet_type)
+        if handlers is None:
+            handlers = self._resolve(dispatch, packet_type)
+        if not handlers:
+            # the driver already traces every packet it receives
+            return 0
+
+        for handler in handlers:
+            try:
+                handler(packet)
+            except BaseDisconnectedError:
+                raise
+            except Exception as e:
+                logger.error(f"Handler {handler.handler.__qualname__} for {packet_type.__name__} failed: {e!r}")
+        return len(handlers)
@@ -0,0 +1,108 @@
+from concurrent.futures import Future
+from threading import Thread
+from typing import List, Optional, Tuple
+
+from mx240a.base import Base
+from mx240a.connection import HandheldManager, Service
+from mx240a.driver import Driver
+from mx240a.handheld import Handheld
+from mx240a.logging import logger
+from mx240a.tonestate import ToneStateStore
+
+
+class Fleet:
+    """
+    Drives every attached base at once, each with its own Driver on its own thread
+
+    All drivers share the handheld manager, the service and the tone state. Handhelds are addressed across bases by
+    address, (base_index << 3) | connection_id, see Driver.address.
+    """
+    drivers: List[Driver]
+    threads: List[Thread]
+    tone_state: ToneStateStore
+
+    def __init__(self, handheld_manager: HandheldManager, service: Service, tone_state_path: Optional[str] = None,
+                 base_paths: Optional[List[bytes]] = None) -> None:
+        """
+        :param handheld_manager: manages registering and connecting handhelds, shared by all bases
+        :param service: the chat service, shared by all bases
+        :param tone_state_path: file to remember uploaded tones in across restarts, None to only remember in memory
+        :param base_paths: hid paths of the bases to drive, defaults to every attached base
+        """
+        if base_paths is None:
+            base_paths = Base.enumerate()
+        if not base_paths:
+            raise RuntimeError("No bases found")
+
+        self.tone_state = ToneStateStore(tone_state_path)
+        self.drivers = [
+            Driver(handheld_manager, service, base_path=path, base_index=index, tone_state=self.tone_state)
+            for index, path in enumerate(base_paths)
+        ]
+        self.threads = []
+
+    def start(self) -> None:
+        """Start a thread per base running its driver's loop"""
+        for driver in self.drivers:
+            thread = Thread(target=driver.loop, name=f"mx240a-base-{driver.base_index}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        logger.info(f"Driving {len(self.drivers)} bases")
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """
+        Stop every driver and wait for its thread, the bases are closed by their drivers
+
+        :param timeout: seconds to wait for each thread
+        """
+        for driver in self.drivers:
+            driver.stop()
+        for thread in self.threads:
+            thread.join(timeout)
+        self.threads = []
+
+    def loop(self) -> None:
+        """Run the fleet until interrupted"""
+        self.start()
+        try:
+            for thread in self.threads:
+                thread.join()
+        except KeyboardInterrupt:
+            logger.info("Caught KeyboardInterrupt, exiting...")
+        finally:
+            self.stop()
+
+    def split_address(self, address: int) -> Tuple[Driver, int]:
+        """
+        :param address: a handheld address
+        :return: the driver of the handheld's base, and its connection id on that base
+        """
+        base_index, connection_id = address >> 3, address & 0x7
+        if base_index >= len(self.drivers) or connection_id == 0:
+            raise ValueError(f"Invalid address {address}")
+        return self.drivers[base_index], connection_id
+
+    def handheld(self, address: int) -> Optional[Handheld]:
+        """
+        :param address: a handheld address
+        :return: the connected handheld at that address, or None
+        """
+        driver, connection_id = self.split_address(address)
+        return driver.connections[connection_id]
+
+    def handhelds(self) -> List[Handheld]:
+        """:return: every connected handheld on every base"""
+        return [handheld for driver in self.drivers for handheld in driver.connections.values() if handheld]
+
+    def send_message(self, address: int, window_id: int, text: str, username: Optional[str] = None) -> Future:
+        """
+        Send a chat message to a window on a handheld on any base, safe to call from any thread
+
+        :param address: the handheld's address
+        :param window_id: the window to show the message in
+        :param text: the message text
+        :param username: the sender shown in a room window, or the buddy's name for a buddy window
+        :return: a future for the message's Layout
+        """
+        driver, connection_id = self.split_address(address)
+        return driver.send_message(connection_id, window_id, text, username)
@@ -1,21 +1,449 @@
-from typing import Optional
+from collections import deque, OrderedDict
+from concurrent.futures import Future
+from threading import RLock
+from typing import Optional, Dict, Set, Final, Tuple, List
 
 import mx240a
+from mx240a.packets import AddBuddyPacket, CreateRoomPacket, TxPacket
+
+BuddyStatus = AddBuddyPacket.Status
+
+
+class IdAllocator:
+    """
+    Hands out ids from a fixed range, reusing released ids
+
+    Released ids go to the back of the free list, so an id is not reused while a stale reference to it is likely
+    """
+    first: int
+    last: int
+    # free ids in the order they are handed out, a dict so take() does not have to search for the id
+    _free: "OrderedDict[int, None]"
+    _used: Set[int]
+
+    def __init__(self, first: int, last: int) -> None:
+        self.first = first
+        self.last = last
+        self._free = OrderedDict.fromkeys(range(first, last + 1))
+        self._used = set()
+
+    def allocate(self) -> int:
+        """
+        :return: a free id
+        """
+        if not self._free:
+            raise RuntimeError(f"No free ids between {self.first:#04x} and {self.last:#04x}")
+        allocated, _ = self._free.popitem(last=False)
+        self._used.add(allocated)
+        return allocated
+
+    def take(self, taken: int) -> int:
+        """
+        Allocate a specific free id, e.g. one just released so whatever used it is replaced
+
+        :param taken: a free id
+        :return: the id
+        """
+        if taken not in self._free:
+            raise ValueError(f"Id {taken:#04x} is not free")
+        del self._free[taken]
+        self._used.add(taken)
+        return taken
+
+    def release(self, released: int) -> None:
+        """
+        :param released: an id from allocate() that is no longer used
+        """
+        if released not in self._used:
+            raise ValueError(f"Id {released:#04x} is not allocated")
+        self._used.remove(released)
+        self._free[released] = None
+
+    def __contains__(self, item: int) -> bool:
+        return item in self._used
+
+    def __len__(self) -> int:
+        return len(self._used)
+
+
+class Buddy:
+    """
+    A buddy on a handheld's buddy list
+
+    buddy_id: the buddy's id, also the id of its window
+    group: name of the group the buddy is in
+    """
+    buddy_id: int
+    screen_name: str
+    group: str
+    status: BuddyStatus
+    mobile: bool
+
+    def __init__(self, buddy_id: int, screen_name: str, group: str, status: BuddyStatus = BuddyStatus.Active,
+                 mobile: bool = False) -> None:
+        self.buddy_id = buddy_id
+        self.screen_name = screen_name
+        self.group = group
+        self.status = status
+        self.mobile = mobile
+
+    def __repr__(self) -> str:
+        return f"<Buddy {self.buddy_id:#04x} \"{self.screen_name}\" group: \"{self.group}\" {self.status.name}>"
+
+
+class Group:
+    """A group of buddies, buddies are kept in the order they were added"""
+    name: str
+    buddies: Dict[int, Buddy]
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.buddies = {}
+
+    def __repr__(self) -> str:
+        return f"<Group \"{self.name}\" buddies: {len(self.buddies)}>"
+
+
+class Room:
+    """A chat room (group conversation) window"""
+    room_id: int
+
+    def __init__(self, room_id: int) -> None:
+        self.room_id = room_id
+
+    def __repr__(self) -> str:
+        return f"<Room {self.room_id:#04x}>"
+
+
+class Window:
+    """An open conversation on a handheld, with either a buddy or a room"""
+    handheld: "Handheld"
+    window_id: int
+    buddy: Optional[Buddy]
+    room: Optional[Room]
+
+    def __init__(self, handheld: "Handheld", window_id: int, buddy: Optional[Buddy] = None,
+                 room: Optional[Room] = None) -> None:
+        self.handheld = handheld
+        self.window_id = window_id
+        self.buddy = buddy
+        self.room = room
+
+    @property
+    def is_room(self) -> bool:
+        return self.room is not None
+
+    def send_message(self, message: str, username: Optional[str] = None) -> Future:
+        """
+        Send a chat message to this window, safe to call from any thread
+
+        :param message: the message text
+        :param username: the sender, for room windows. Buddy windows show the buddy's screen name
+        :return: a future for the layout of the message
+        """
+        if self.buddy is not None:
+            username = self.buddy.screen_name
+        return self.handheld.send_message(self.window_id, message, username)
+
+    def __repr__(self) -> str:
+        return f"<Window {self.window_id:#04x} {self.buddy or self.room}>"
 
 
 class Handheld:
+    """
+    A connected handheld and its session: buddy list, rooms and open windows
+
+    Buddies, groups, rooms and windows are indexed by id (and buddies by screen name), lookups don't scan the lists.
+    Buddy ids (0x01 - 0x80) and room ids (0x81 - 0x8f) are recycled when buddies and rooms are removed.
+
+    The session can be changed from any thread (services, the driver's presence updates). Changes hold lock and queue
+    their packets while holding it, so the handheld gets them in the order they were made and a status update never
+    goes out for a buddy id that was already given to someone else. Hold lock to read several things consistently.
+    """
     driver: "mx240a.Driver"
     connection_id: int
     handheld_id: str
 
+    service: "mx240a.Service"
+    connected: bool
     username: Optional[str]
     password: Optional[str]
 
+    buddies: Dict[int, Buddy]
+    buddies_by_name: Dict[str, Buddy]
+    groups: Dict[str, Group]
+    rooms: Dict[int, Room]
+    windows: Dict[int, Window]
+    buddy_ids: IdAllocator
+    room_ids: IdAllocator
+    lock: RLock
+
+    FIRST_BUDDY_ID: Final[int] = 0x01
+    LAST_BUDDY_ID: Final[int] = 0x80
+    FIRST_ROOM_ID: Final[int] = 0x81
+    # 0x9x and up would be read as other packets when the handheld sends to the room
+    LAST_ROOM_ID: Final[int] = 0x8f
+
     def __init__(self, driver: "mx240a.Driver", connection_id: int, handheld_id: str) -> None:
         self.driver = driver
         self.connection_id = connection_id
         self.handheld_id = handheld_id
 
+        # until HandheldManager.connect picks one
+        self.service = driver.service
+        self.connected = False
         self.username = None
         self.password = None
 
+        self.buddies = {}
+        self.buddies_by_name = {}
+        self.groups = {}
+        self.rooms = {}
+        self.windows = {}
+        self.buddy_ids = IdAllocator(Handheld.FIRST_BUDDY_ID, Handheld.LAST_BUDDY_ID)
+        self.room_ids = IdAllocator(Handheld.FIRST_ROOM_ID, Handheld.LAST_ROOM_ID)
+        self.lock = RLock()
+
+    @property
+    def address(self) -> int:
+        """The handheld's connection address, unique across all bases"""
+        return self.driver.address(self.connection_id)
+
+    def send_message(self, window_id: int, message: str, username: Optional[str] = None) -> Future:
+        """
+        Send a chat message to a window on this handheld, safe to call from any thread
+
+        :param window_id: the window to show the message in
+        :param message: the message text
+        :param username: the sender shown in a room window, or the buddy's name for a buddy window
+        :return: a future for the layout of the message, to preview it or see how many bytes were sent
+        """
+        return self.driver.send_message(self.connection_id, window_id, message, username)
+
+    def add_buddy(self, screen_name: str, group: str, status: BuddyStatus = BuddyStatus.Active,
+                  mobile: bool = False, buddy_id: Optional[int] = None) -> Buddy:
+        """
+        Add a buddy to the handheld's buddy list
+
+        :param screen_name: the buddy's name
+        :param group: the group to show the buddy in, only the first 6 characters are shown
+        :param status: the buddy's status
+        :param mobile: if the buddy is on a mobile device
+        :param buddy_id: a free id to use, e.g. the id of a just removed buddy so the new one replaces it on the
+            handheld. Defaults to the next free id
+        :return: the buddy
+        """
+        with self.lock:
+            if screen_name in self.buddies_by_name:
+                raise ValueError(f"Buddy {screen_name} is already on the buddy list")
+
+            buddy = self._insert_buddy(screen_name, group, status, mobile, buddy_id)
+            self.driver.send_packet(self._add_buddy_packet(buddy))
+            return buddy
+
+    def _insert_buddy(self, screen_name: str, group: str, status: BuddyStatus, mobile: bool,
+                      buddy_id: Optional[int] = None) -> Buddy:
+        buddy_id = self.buddy_ids.allocate() if buddy_id is None else self.buddy_ids.take(buddy_id)
+        buddy = Buddy(buddy_id, screen_name, group, status, mobile)
+        self.buddies[buddy_id] = buddy
+        self.buddies_by_name[screen_name] = buddy
+        self._group(buddy)
+        return buddy
+
+    def _group(self, buddy: Buddy) -> None:
+        if buddy.group not in self.groups:
+            self.groups[buddy.group] = Group(buddy.group)
+        self.groups[buddy.group].buddies[buddy.buddy_id] = buddy
+
+    def _ungroup(self, buddy: Buddy) -> None:
+        group = self.groups[buddy.group]
+        del group.buddies[buddy.buddy_id]
+        if not group.buddies:
+            del self.groups[buddy.group]
+
+    def _update_buddy(self, buddy: Buddy, group: str, status: BuddyStatus, mobile: bool) -> bool:
+        """
+        :return: True if anything changed and the buddy has to be sent again
+        """
+        if buddy.group == group and buddy.status == status and buddy.mobile == mobile:
+            return False
+        if buddy.group != group:
+            self._ungroup(buddy)
+            buddy.group = group
+            self._group(buddy)
+        buddy.status = status
+        buddy.mobile = mobile
+        return True
+
+    def _add_buddy_packet(self, buddy: Buddy) -> AddBuddyPacket:
+        return AddBuddyPacket(self.connection_id, buddy.buddy_id, buddy.screen_name, buddy.group, buddy.status,
+                              buddy.mobile)
+
+    def set_buddy_status(self, screen_name: str, status: BuddyStatus, mobile: bool) -> Optional[Future]:
+        """
+        Change a buddy's status on the handheld, if it is different
+
+        Statuses that change often should go through Driver.set_buddy_status, which coalesces them
+
+        :param screen_name: the buddy
+        :param status: the buddy's status
+        :param mobile: if the buddy is on a mobile device
+        :return: a future for the update, None if nothing changed
+        """
+        with self.lock:
+            buddy = self.buddies_by_name.get(screen_name)
+            if buddy is None:
+                raise ValueError(f"Buddy {screen_name} is not on the buddy list")
+            return self.update_buddy(screen_name, buddy.group, status, mobile)
+
+    def update_buddy(self, screen_name: str, group: str, status: BuddyStatus, mobile: bool) -> Optional[Future]:
+        """
+        Change a buddy's group or status on the handheld, if it is different
+
+        The buddy keeps its id, sending it again on that id replaces its entry on the handheld
+
+        :param screen_name: the buddy
+        :param group: the group to show the buddy in
+        :param status: the buddy's status
+        :param mobile: if the buddy is on a mobile device
+        :return: a future for the update, None if nothing changed
+        """
+        with self.lock:
+            buddy = self.buddies_by_name.get(screen_name)
+            if buddy is None:
+                raise ValueError(f"Buddy {screen_name} is not on the buddy list")
+            if not self._update_buddy(buddy, group, status, mobile):
+                return None
+            return self.driver.send_packet(self._add_buddy_packet(buddy))
+
+    def sync_buddy_list(self, desired: Dict[str, Tuple[str, BuddyStatus, bool]]) -> Future:
+        """
+        Make the handheld's buddy list match the desired one, sending only what changed
+
+        Buddies that are gone are removed, changed buddies are sent again on their own id, then new buddies are
+        added. New buddies take the removed buddies' ids first, so they replace them on the handheld (there is no
+        known packet to remove a buddy). Everything is sent as one batch.
+
+        :param desired: (group, status, mobile) by screen name
+        :return: a future, done once every change has been written to the base
+        """
+        with self.lock:
+            if len(desired) > self.LAST_BUDDY_ID - self.FIRST_BUDDY_ID + 1:
+                raise ValueError(f"Too many buddies: {len(desired)}")
+
+            gone = [screen_name for screen_name in self.buddies_by_name if screen_name not in desired]
+            freed = deque(self.remove_buddy(screen_name).buddy_id for screen_name in gone)
+
+            packets: List[TxPacket] = []
+            added: List[Tuple[str, str, BuddyStatus, bool]] = []
+            for screen_name, (group, status, mobile) in desired.items():
+                buddy = self.buddies_by_name.get(screen_name)
+                if buddy is None:
+                    added.append((screen_name, group, status, mobile))
+                elif self._update_buddy(buddy, group, status, mobile):
+                    packets.append(self._add_buddy_packet(buddy))
+
+            for screen_name, group, status, mobile in added:
+                buddy_id = freed.popleft() if freed else None
+                packets.append(self._add_buddy_packet(self._insert_buddy(screen_name, group, status, mobile, buddy_id)))
+            return self.driver.send_packets(self.connection_id, packets)
+
+    def adopt_buddy_list(self, previous: "Handheld") -> None:
+        """
+        Take over the buddy list of an earlier connection of the same handheld, which the handheld still has
+
+        :param previous: the handheld's last session
+        """
+        with self.lock:
+            self.buddies = previous.buddies
+            self.buddies_by_name = previous.buddies_by_name
+            self.groups = previous.groups
+            self.buddy_ids = previous.buddy_ids
+
+    def remove_buddy(self, screen_name: str) -> Buddy:
+        """
+        Remove a buddy from the session and free its id
+
+        There is no known packet to remove a buddy from the handheld itself, it stays on the handheld's list until
+        its id is reused. Its window is closed here and messages from it are no longer matched to it.
+
+        :param screen_name: the buddy's name
+        :return: the removed buddy
+        """
+        with self.lock:
+            buddy = self.buddies_by_name.pop(screen_name, None)
+            if buddy is None:
+                raise ValueError(f"Buddy {screen_name} is not on the buddy list")
+
+            del self.buddies[buddy.buddy_id]
+            self._ungroup(buddy)
+            self.windows.pop(buddy.buddy_id, None)
+            self.buddy_ids.release(buddy.buddy_id)
+            return buddy
+
+    def buddy(self, buddy_id: int) -> Optional[Buddy]:
+        return self.buddies.get(buddy_id)
+
+    def find_buddy(self, screen_name: str) -> Optional[Buddy]:
+        return self.buddies_by_name.get(screen_name)
+
+    def create_room(self) -> Window:
+        """
+        Create a room on the handheld and open its window
+
+        :return: the room's window
+        """
+        with self.lock:
+            room = Room(self.room_ids.allocate())
+            self.rooms[room.room_id] = room
+            self.windows[room.room_id] = window = Window(self, room.room_id, room=room)
+            self.driver.send_packet(CreateRoomPacket(self.connection_id, room.room_id))
+            return window
+
+    def remove_room(self, room_id: int) -> Room:
+        """
+        Remove a room from the session and free its id
+
+        :param room_id: the room
+        :return: the removed room
+        """
+        with self.lock:
+            room = self.rooms.pop(room_id, None)
+            if room is None:
+                raise ValueError(f"No room {room_id:#04x}")
+            self.windows.pop(room_id, None)
+            self.room_ids.release(room_id)
+            return room
+
+    def open_window(self, window_id: int) -> Optional[Window]:
+        """
+        Called when the handheld opens a window
+
+        :param window_id: the buddy or room id of the window
+        :return: the window, None if there is no buddy or room with that id
+        """
+        with self.lock:
+            if window := self.windows.get(window_id):
+                return window
+
+            if buddy := self.buddies.get(window_id):
+                window = Window(self, window_id, buddy=buddy)
+            elif room := self.rooms.get(window_id):
+                window = Window(self, window_id, room=room)
+            else:
+                return None
+            self.windows[window_id] = window
+            return window
+
+    def close_window(self, window_id: int) -> Optional[Window]:
+        """
+        Called when the handheld closes a window
+
+        :param window_id: the window
+        :return: the closed window, None if it was not open
+        """
+        with self.lock:
+            return self.windows.pop(window_id, None)
+
+    def __repr__(self) -> str:
+        return f"<Handheld {self.handheld_id} connection: {self.connection_id} buddies: {len(self.buddies)}>"
@@ -0,0 +1,86 @@
+from typing import List, Tuple, Dict, Optional, Hashable
+
+from mx240a.connection import HandheldConnectData
+from mx240a.packets import HandheldInfoPacket, ServiceInfoPacket, RingtonePacket
+from mx240a.rtttl import MUTE_TONE
+from mx240a.util import restamp
+
+
+class HandshakeScript:
+    """
+    The connect sequence for a handheld, compiled to frames once so reconnects just replay it
+
+    Frames are compiled for one connection id and restamped for others.
+
+    frames: the handheld and service info frames
+    tones: (tone name, tone bytes as uploaded, frames) for every tone
+    """
+    fingerprint: Hashable
+    connection_id: int
+    frames: List[bytes]
+    tones: List[Tuple[str, bytes, List[bytes]]]
+
+    def __init__(self, connection_id: int, connect_info: HandheldConnectData, service_id: str) -> None:
+        self.fingerprint = HandshakeScript.make_fingerprint(connect_info, service_id)
+        self.connection_id = connection_id
+        self.frames = [
+            *HandheldInfoPacket(connection_id, connect_info.handheld_name).encode(),
+            *ServiceInfoPacket(connection_id, service_id).encode(),
+        ]
+        self.tones = []
+        for tone_name, tone in connect_info.tones.as_dict().items():
+            packet = RingtonePacket(connection_id, tone_name, tone if tone else MUTE_TONE)
+            # tone state hashes the bytes the handheld actually gets, so a change to the optimizer uploads tones again
+            self.tones.append((tone_name, packet.optimized.tone_bytes, list(packet.encode())))
+
+    @staticmethod
+    def make_fingerprint(connect_info: HandheldConnectData, service_id: str) -> Hashable:
+        """
+        :return: a value that changes whenever the compiled script would
+        """
+        return (
+            connect_info.handheld_name,
+            service_id,
+            tuple(tone.tone_bytes if tone else None for tone in connect_info.tones.as_dict().values()),
+        )
+
+    def info_frames(self, connection_id: int) -> List[bytes]:
+        if connection_id == self.connection_id:
+            return self.frames
+        return [restamp(frame, connection_id) for frame in self.frames]
+
+    def tone_frames(self, frames: List[bytes], connection_id: int) -> List[bytes]:
+        if connection_id == self.connection_id:
+            return frames
+        return [restamp(frame, connection_id) for frame in frames]
+
+
+class HandshakeCache:
+    """Compiled handshake scripts by handheld_id"""
+    _scripts: Dict[str, HandshakeScript]
+
+    def __init__(self) -> None:
+        self._scripts = {}
+
+    def get(self, handheld_id: str, connection_id: int, connect_info: HandheldConnectData,
+            service_id: str) -> HandshakeScript:
+        """
+        Get the handshake script for a handheld, compiling it if it is not cached or the connect data changed
+
+        :return: the script
+        """
+        script = self._scripts.get(handheld_id)
+        if script is None or script.fingerprint != HandshakeScript.make_fingerprint(connect_info, service_id):
+            script = self._scripts[handheld_id] = HandshakeScript(connection_id, connect_info, service_id)
+        return script
+
+    def invalidate(self, handheld_id: Optional[str] = None) -> None:
+        """
+        Drop cached scripts
+
+        :param handheld_id: the handheld, or None for all handhelds
+        """
+        if handheld_id is None:
+            self._scripts.clear()
+        else:
+            self._scripts.pop(handheld_id, None)
@@ -0,0 +1,155 @@
+from typing import List, Final
+
+from mx240a.charset import CODEC_NAME
+
+LINE_WIDTH: Final[int] = 30
+
+
+def _advance(col: int, count: int, width: int) -> int:
+    """
+    Move the cursor forward, the handheld only breaks a full line once the next character arrives
+
+    :param col: columns used on the current line
+    :param count: number of characters written
+    :param width: width of the display in columns
+    :return: columns used on the line the cursor ends up on
+    """
+    if count <= 0:
+        return col
+    return (col + count - 1) % width + 1
+
+
+def pad_wrap(message: bytes, prefix_len: int, width: int = LINE_WIDTH) -> bytearray:
+    """
+    Wrap a message the way the original driver did, breaking mid-word and padding every broken line with spaces
+
+    :param message: the message bytes
+    :param prefix_len: number of columns already used on the first line (the "name:" prefix)
+    :param width: width of the display in columns
+    :return: the padded message
+    """
+    out = bytearray()
+    col = _advance(0, prefix_len, width)
+    for byte in message:
+        if byte == 0x0a or col == width:
+            out += b" " * (width - col)
+            col = 0
+        out.append(byte)
+        col += 1
+    return out
+
+
+def word_wrap(message: bytes, prefix_len: int, width: int = LINE_WIDTH, wrap_words: bool = True) -> bytearray:
+    """
+    Wrap a message using as few bytes as possible
+
+    The handheld wraps on its own once a line is full, so only lines that have to break early get padded, and only
+    with the spaces needed to reach the end of the line. Spaces swallowed by a line break, trailing spaces and line
+    feeds are not sent at all.
+
+    :param message: the message bytes
+    :param prefix_len: number of columns already used on the first line (the "name:" prefix)
+    :param width: width of the display in columns
+    :param wrap_words: move words that do not fit to the next line, otherwise let the handheld break them
+    :return: the bytes to send
+    """
+    out = bytearray()
+    # 0 = at the start of an empty line, width = line is full and the next character starts a new one
+    col = _advance(0, prefix_len, width)
+
+    for line_num, line in enumerate(message.split(b"\n")):
+        if line_num:
+            # explicit line break, fill out the rest of the current line (or a whole empty one)
+            out += b" " * (width - col)
+            col = 0
+
+        if not wrap_words:
+            out += line
+            col = _advance(col, len(line), width)
+            continue
+
+        gap = 0
+        first = True
+        for word in line.split(b" "):
+            if not word:
+                gap += 1
+                continue
+            if not first:
+                gap += 1
+            first = False
+
+            word_len = len(word)
+            if col + gap + word_len <= width:
+                out += b" " * gap
+                out += word
+                col += gap + word_len
+            elif col == 0:
+                # indent does not fit, drop it
+                out += word
+                col = _advance(0, word_len, width)
+            elif word_len <= width:
+                # move the word to the next line
+                out += b" " * (width - col)
+                out += word
+                col = _advance(0, word_len, width)
+            else:
+                # word is longer than a line, let the handheld break it
+                if col + gap < width:
+                    out += b" " * gap
+                    col += gap
+                else:
+                    # the gap reaches the end of the line, start the word on the next one
+                    out += b" " * (width - col)
+                    col = 0
+                out += word
+                col = _advance(col, word_len, width)
+            gap = 0
+
+    return out.rstrip(b" ")
+
+
+class Layout:
+    """
+    A message laid out for the handheld display
+
+    data: the bytes to send
+    prefix: the "name:" prefix the handheld shows in front of the message
+    width: width of the display in columns
+    wrap_words: whether words are kept together, word wrapping costs padding bytes on every early line break
+    """
+    data: bytes
+    prefix: bytes
+    width: int
+    wrap_words: bool
+
+    def __init__(self, message: bytes, prefix: bytes = b"", width: int = LINE_WIDTH, wrap_words: bool = True) -> None:
+        self.prefix = prefix
+        self.width = width
+        self.wrap_words = wrap_words
+        self.data = bytes(word_wrap(message, len(prefix), width, wrap_words))
+        self._message = message
+
+    @property
+    def byte_count(self) -> int:
+        """Number of bytes of message text sent to the handheld"""
+        return len(self.data)
+
+    @property
+    def padded_byte_count(self) -> int:
+        """Number of bytes the original driver's padded layout would have sent"""
+        return len(pad_wrap(self._message, len(self.prefix), self.width))
+
+    @property
+    def lines(self) -> List[str]:
+        """The message as it will be rendered on the handheld, one string per display line"""
+        screen = self.prefix + self.data
+        return [
+            screen[i:i + self.width].decode(CODEC_NAME, "replace").rstrip(" ")
+            for i in range(0, max(len(screen), 1), self.width)
+        ]
+
+    def preview(self) -> str:
+        return "\n".join(self.lines)
+
+    def __repr__(self) -> str:
+        return f"<Layout bytes: {self.byte_count} (padded: {self.padded_byte_count}) lines: {len(self.lines)}>"
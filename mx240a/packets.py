@@ -1,8 +1,12 @@
 from abc import ABC, abstractmethod
 from enum import Enum
-from typing import Dict, Final, Iterator
+from typing import Dict, Final, Iterator, Optional, Union, List
 
-from mx240a.rtttl import Ringtone
+from mx240a.layout import Layout, LINE_WIDTH
+from mx240a.logging import logger
+from mx240a.rtttl import Ringtone, OptimizedTone, optimize_tone
+from mx240a.schema import Schema, Connection, Opcode, Byte, Text, Data, Hex, Terminator
+from mx240a.translit import transliterate
 from mx240a.util import hexdump, to_hex, as_bytes
 
 
@@ -16,6 +20,17 @@ class Packet(ABC):
 
     @staticmethod
     def decode(raw_data: bytes) -> "Packet":
+        """
+        Decode a frame from the base, a garbled or truncated frame becomes an UnknownPacket instead of an error
+        """
+        try:
+            return Packet._decode(raw_data)
+        except (ValueError, IndexError) as e:
+            logger.warning(f"Could not decode packet {hexdump(raw_data)}: {e}")
+            return UnknownPacket(raw_data)
+
+    @staticmethod
+    def _decode(raw_data: bytes) -> "Packet":
         byte_1 = raw_data[0]
         byte_2 = raw_data[1]
 
@@ -116,8 +131,10 @@ class ACKPacket(UnknownPacket):
 class HandheldDisconnectedPacket(RxPacket):
     connection_id: int
 
+    SCHEMA: Final[Schema] = Schema(Connection(0xe0), Opcode(0x8c))
+
     def __init__(self, raw_data) -> None:
-        self.connection_id = raw_data[0] & 0xf
+        self.SCHEMA.decode(self, raw_data)
 
     def __repr__(self) -> str:
         return f"<HandheldDisconnectedPacket connection: {self.connection_id}>"
@@ -126,8 +143,10 @@ class HandheldDisconnectedPacket(RxPacket):
 class HandheldLogoffPacket(RxPacket):
     connection_id: int
 
+    SCHEMA: Final[Schema] = Schema(Connection(0xe0), Opcode(0x93))
+
     def __init__(self, raw_data) -> None:
-        self.connection_id = raw_data[0] & 0xf
+        self.SCHEMA.decode(self, raw_data)
 
     def __repr__(self) -> str:
         return f"<HandheldLogoffPacket connection: {self.connection_id}>"
@@ -137,9 +156,10 @@ class HandheldConnectingPacket(RxPacket):
     handheld_id: str
     connection_id: int
 
+    SCHEMA: Final[Schema] = Schema(Connection(0xe0), Opcode(0x8e), Hex("handheld_id", 4))
+
     def __init__(self, raw_data) -> None:
-        self.handheld_id = "".join([to_hex(b) for b in raw_data[2:6]])
-        self.connection_id = raw_data[0] & 0xf
+        self.SCHEMA.decode(self, raw_data)
 
     def __repr__(self) -> str:
         return f"<HandheldConnectingPacket id: {self.handheld_id}, connection: {self.connection_id}>"
@@ -149,12 +169,10 @@ class HandheldUsernamePacket(RxPacket):
     connection_id: int
     username: str
 
+    SCHEMA: Final[Schema] = Schema(Connection(0xe0), Opcode(0x91), Text("username"), Terminator())
+
     def __init__(self, raw_data) -> None:
-        self.connection_id = raw_data[0] & 0xf
-        if len(raw_data) > 2:
-            self.username = "".join([chr(c) for c in raw_data[2:]])
-        else:
-            self.username = ""
+        self.SCHEMA.decode(self, raw_data)
 
     def __repr__(self) -> str:
         return f"<HandheldUsernamePacket username: \"{self.username}\", connection: {self.connection_id}>"
@@ -164,23 +182,39 @@ class HandheldPasswordPacket(RxPacket):
     connection_id: int
     password: str
 
+    SCHEMA: Final[Schema] = Schema(Connection(0xe0), Opcode(0x92), Text("password"), Terminator())
+
     def __init__(self, raw_data) -> None:
-        self.connection_id = raw_data[0] & 0xf
-        if len(raw_data) > 2:
-            self.password = "".join([chr(c) for c in raw_data[2:]])
-        else:
-            self.password = ""
+        self.SCHEMA.decode(self, raw_data)
 
     def __repr__(self) -> str:
         return f"<HandheldPasswordPacket password: \"{self.password}\", connection: {self.connection_id}>"
 
 
-class OpenWindowPacket(UnknownPacket):
-    pass
+class OpenWindowPacket(RxPacket):
+    connection_id: int
+    window_id: int
 
+    SCHEMA: Final[Schema] = Schema(Connection(0xf0), Opcode(0x94), Byte("window_id"), Terminator())
 
-class CloseWindowPacket(UnknownPacket):
-    pass
+    def __init__(self, raw_data) -> None:
+        self.SCHEMA.decode(self, raw_data)
+
+    def __repr__(self) -> str:
+        return f"<OpenWindowPacket window: {self.window_id}, connection: {self.connection_id}>"
+
+
+class CloseWindowPacket(RxPacket):
+    connection_id: int
+    window_id: int
+
+    SCHEMA: Final[Schema] = Schema(Connection(0xf0), Opcode(0x95), Byte("window_id"), Terminator())
+
+    def __init__(self, raw_data) -> None:
+        self.SCHEMA.decode(self, raw_data)
+
+    def __repr__(self) -> str:
+        return f"<CloseWindowPacket window: {self.window_id}, connection: {self.connection_id}>"
 
 
 class HandsetAwayPacket(UnknownPacket):
@@ -195,34 +229,79 @@ class HandsetInvitePacket(UnknownPacket):
     pass
 
 
-class HandsetRequestResponsePacket(UnknownPacket):
-    pass
+class HandsetRequestResponsePacket(RxPacket):
+    connection_id: int
+    response: int
 
+    SCHEMA: Final[Schema] = Schema(Connection(0xf0), Opcode(0x9d), Byte("response"), Terminator())
 
-class MessagePacket(UnknownPacket):
-    pass
+    def __init__(self, raw_data) -> None:
+        self.SCHEMA.decode(self, raw_data)
+
+    @property
+    def accepted(self) -> bool:
+        # "A" = accept, "D" = deny
+        return self.response == ord("A")
+
+    def __repr__(self) -> str:
+        return f"<HandsetRequestResponsePacket accepted: {self.accepted}, connection: {self.connection_id}>"
+
+
+class MessagePacket(RxPacket):
+    """
+    One fragment of a chat message typed on the handheld
+
+    Long messages arrive as several fragments, every fragment but the last ends with 0xfe
+    """
+    connection_id: int
+    window_id: int
+    data: bytes
+    final: bool
+
+    _NON_PRINTABLE: Final[bytes] = bytes(b for b in range(256) if not 32 <= b <= 127)
+
+    def __init__(self, raw_data) -> None:
+        self.connection_id = raw_data[0] & 0xf
+        self.window_id = raw_data[1] if len(raw_data) > 1 else 0
+
+        data = bytes(raw_data[2:])
+        end = data.find(0xfe)
+        self.final = end == -1
+        if not self.final:
+            data = data[:end]
+        self.data = data.translate(None, MessagePacket._NON_PRINTABLE)
+
+    def __repr__(self) -> str:
+        return f"<MessagePacket window: {self.window_id} final: {self.final} data: {hexdump(self.data)}, " \
+               f"connection: {self.connection_id}>"
 
 
 # Tx Packets Begin Here
 class BaseInitPacket(TxPacket):
+    SCHEMA: Final[Schema] = Schema(Opcode(0xad), Opcode(0xef), Opcode(0x8d), Terminator())
+
     def encode(self) -> Iterator[bytes]:
-        yield bytes([0xad, 0xef, 0x8d, 0xff])
+        yield self.SCHEMA.encode()
 
     def __repr__(self) -> str:
         return "<BaseInitPacket>"
 
 
 class BaseShutdownPacket(TxPacket):
+    SCHEMA: Final[Schema] = Schema(Opcode(0xef), Opcode(0x8d), Terminator())
+
     def encode(self) -> Iterator[bytes]:
-        yield bytes([0xef, 0x8d, 0xff])
+        yield self.SCHEMA.encode()
 
     def __repr__(self) -> str:
         return "<BaseInitPacket>"
 
 
 class PollingPacket(TxPacket):
+    SCHEMA: Final[Schema] = Schema(Opcode(0xad))
+
     def encode(self) -> Iterator[bytes]:
-        yield bytes([0xad])
+        yield self.SCHEMA.encode()
 
     def __repr__(self) -> str:
         return "<PollingPacket>"
@@ -232,6 +311,8 @@ class ServiceInfoPacket(TxPacket):
     connection_id: int
     service_name: str
 
+    SCHEMA: Final[Schema] = Schema(Connection(0xc0), Opcode(0xd7), Text("service_name", max_length=6), Terminator())
+
     def __init__(self, connection_id: int, service_name: str) -> None:
         if connection_id > 7 or connection_id < 1:
             raise ValueError("Invalid connection_id")
@@ -244,12 +325,7 @@ class ServiceInfoPacket(TxPacket):
         self.service_name = service_name
 
     def encode(self) -> Iterator[bytes]:
-        yield bytes([
-            0xc0 | self.connection_id,
-            0xd7,
-            *as_bytes(self.service_name),
-            0xff,
-        ])
+        yield self.SCHEMA.encode(connection_id=self.connection_id, service_name=self.service_name)
 
     def __repr__(self) -> str:
         return f"<ServiceInfoPacket name: \"{self.service_name}\" connection id: {self.connection_id}>"
@@ -259,6 +335,8 @@ class HandheldInfoPacket(TxPacket):
     connection_id: int
     handheld_name: str
 
+    SCHEMA: Final[Schema] = Schema(Connection(0xc0), Opcode(0xd9), Text("handheld_name"), Terminator())
+
     def __init__(self, connection_id: int, handheld_name: str) -> None:
         if connection_id > 7 or connection_id < 1:
             raise ValueError("Invalid connection_id")
@@ -267,21 +345,22 @@ class HandheldInfoPacket(TxPacket):
         self.handheld_name = handheld_name
 
     def encode(self) -> Iterator[bytes]:
-        yield bytes([
-            0xc0 | self.connection_id,
-            0xd9,
-            *as_bytes(self.handheld_name),
-            0xff,
-        ])
+        yield self.SCHEMA.encode(connection_id=self.connection_id, handheld_name=self.handheld_name)
 
     def __repr__(self) -> str:
         return f"<HandheldInfoPacket name: \"{self.handheld_name}\" connection id: {self.connection_id}>"
 
 
 class RingtonePacket(TxPacket):
+    """
+    Sets one of the handheld's tones
+
+    The tone is optimized with rtttl.optimize_tone first, and cut off if it is longer than MAX_TONE_BYTES
+    """
     connection_id: int
     tone_id: int
     tone: Ringtone
+    optimized: OptimizedTone
 
     TONE_NAME_TO_ID: Final[Dict[str, int]] = {
         "new_message": 0x02,
@@ -295,7 +374,18 @@ class RingtonePacket(TxPacket):
         "enter_sleep_mode": 0x0a,
     }
 
-    def __init__(self, connection_id: int, tone_id: str, tone: Ringtone) -> None:
+    START_SCHEMA: Final[Schema] = Schema(
+        Connection(0xc0), Opcode(0xcd), Byte("tone_id", 0x02, 0x0a), Data("tone_data"), Terminator()
+    )
+    PART_SCHEMA: Final[Schema] = Schema(
+        Connection(0x80), Opcode(0xcd), Byte("tone_id", 0x02, 0x0a), Data("tone_data"), Terminator()
+    )
+
+    FRAME_SIZE: Final[int] = 20
+    # the real limit is not known, 6 frames keeps the handshake short and fits all the original driver's tones
+    MAX_TONE_BYTES: Final[int] = 6 * FRAME_SIZE
+
+    def __init__(self, connection_id: int, tone_id: str, tone: Ringtone, merge_notes: bool = False) -> None:
         self.connection_id = connection_id
 
         try:
@@ -304,42 +394,30 @@ class RingtonePacket(TxPacket):
             raise ValueError("Invalid tone_id")
 
         self.tone = tone
+        self.optimized = optimize_tone(tone.tone_bytes, RingtonePacket.MAX_TONE_BYTES, merge_notes)
+        if self.optimized.dropped_notes:
+            logger.warning(f"Tone {tone_id} is too long, cut off {self.optimized.dropped_notes} notes "
+                           f"({self.optimized.fidelity:.0%} of the tone kept)")
 
     def encode(self) -> Iterator[bytes]:
-        yield bytes([
-            0xc0 | self.connection_id,
-            0xcd,
-            self.tone_id,
-            *self.tone.tone_bytes[:20],
-            0xff,
-        ])
-
-        tone_bytes = self.tone.tone_bytes
-        tone_parts = [tone_bytes[i:i + 20] for i in range(0, len(tone_bytes), 20)]
-
-        if len(tone_parts) > 1:
-            for part in tone_parts:
-                yield bytes([
-                    0x80 | self.connection_id,
-                    0xcd,
-                    self.tone_id,
-                    *part,
-                    0xff,
-                ])
+        tone_bytes = self.optimized.tone_bytes
+        size = RingtonePacket.FRAME_SIZE
+        yield self.START_SCHEMA.encode(self.connection_id, self.tone_id, tone_bytes[:size])
+
+        for i in range(size, len(tone_bytes), size):
+            yield self.PART_SCHEMA.encode(self.connection_id, self.tone_id, tone_bytes[i:i + size])
 
 
 class LoginSuccessPacket(TxPacket):
+    SCHEMA: Final[Schema] = Schema(Connection(0xe0), Opcode(0xd3), Terminator())
+
     def __init__(self, connection_id: int) -> None:
         if connection_id > 7 or connection_id < 1:
             raise ValueError("Invalid connection_id")
         self.connection_id = connection_id
 
     def encode(self) -> Iterator[bytes]:
-        yield bytes([
-            0xe0 | self.connection_id,
-            0xd3,
-            0xff,
-        ])
+        yield self.SCHEMA.encode(connection_id=self.connection_id)
 
     def __repr__(self) -> str:
         return f"<LoginSuccessPacket connection id: {self.connection_id}>"
@@ -356,6 +434,8 @@ class ErrorPacket(TxPacket):
         SessionTerminated = 0x08
         InternetConnectionLost = 0x09
 
+    SCHEMA: Final[Schema] = Schema(Connection(0xe0), Opcode(0xe5), Byte("errno"), Terminator())
+
     def __init__(self, connection_id: int, errno: ErrorType) -> None:
         if connection_id > 7 or connection_id < 1:
             raise ValueError("Invalid connection_id")
@@ -363,12 +443,184 @@ class ErrorPacket(TxPacket):
         self.errno = errno
 
     def encode(self) -> Iterator[bytes]:
-        yield bytes([
-            0xe0 | self.connection_id,
-            0xe5,
-            self.errno.value,
-            0xff,
-        ])
+        yield self.SCHEMA.encode(connection_id=self.connection_id, errno=self.errno.value)
 
     def __repr__(self) -> str:
         return f"<ErrorPacket connection id: {self.connection_id} errno: {self.errno.name}>"
+
+
+class SendMessagePacket(TxPacket):
+    """
+    A chat message sent to a window on the handheld
+
+    Buddy windows (ids 0x01 - 0x80) show the buddy's name themselves, so username is only used to line up the
+    wrapping. Room windows (ids 0x81+) send username as the sender shown in front of the message.
+
+    Text is run through mx240a.translit first, then laid out with mx240a.layout, see the layout attribute for a
+    preview and the number of bytes sent.
+    """
+    connection_id: int
+    window_id: int
+    message: bytes
+    username: Optional[str]
+    layout: Layout
+    _frames: Optional[List[bytes]]
+
+    END_SCHEMA: Final[Schema] = Schema(Connection(0xe0), Opcode(0xce), Byte("window_id", 0x01))
+
+    BUDDY_PAYLOAD_SIZE: Final[int] = 21
+    ROOM_PAYLOAD_SIZE: Final[int] = 22
+
+    def __init__(self, connection_id: int, window_id: int, message: Union[str, bytes],
+                 username: Optional[str] = None, wrap_words: bool = True) -> None:
+        if connection_id > 7 or connection_id < 1:
+            raise ValueError("Invalid connection_id")
+        if window_id > 0xff or window_id < 1:
+            raise ValueError("Invalid window_id")
+
+        self.connection_id = connection_id
+        self.window_id = window_id
+        self.message = as_bytes(transliterate(message)) if isinstance(message, str) else bytes(message)
+        self.username = username = transliterate(username) if username else username
+
+        # room messages start with the ascii username followed by a ':', messages to a buddy have a null username
+        if self.is_room:
+            if not username:
+                logger.warning("Room messages should have a username")
+                self._header = as_bytes(":")
+            else:
+                self._header = as_bytes(username.replace(":", "") + ":")
+            prefix = self._header
+        else:
+            self._header = b"\x00"
+            prefix = as_bytes(username + ":") if username else b""
+
+        self.layout = Layout(self.message, prefix, LINE_WIDTH, wrap_words)
+        self._frames = None
+
+    @property
+    def is_room(self) -> bool:
+        return self.window_id > 0x80
+
+    def encode(self) -> Iterator[bytes]:
+        payload_size = SendMessagePacket.ROOM_PAYLOAD_SIZE if self.is_room else SendMessagePacket.BUDDY_PAYLOAD_SIZE
+        body = bytearray(self._header)
+        body += self.layout.data
+        view = memoryview(body)
+
+        start_byte = 0x80 | self.connection_id
+        for i in range(0, len(body), payload_size):
+            frame = bytearray((start_byte, self.window_id))
+            frame += view[i:i + payload_size]
+            if len(body) - i < payload_size:
+                frame.append(0xff)
+            yield bytes(frame)
+
+        if len(body) % payload_size == 0:
+            # and some more padding for the last 0xff, just in case
+            yield bytes([start_byte, self.window_id, 0xff])
+
+        yield self.END_SCHEMA.encode(self.connection_id, self.window_id)
+
+    def encode_for(self, connection_id: int, window_id: int) -> List[bytes]:
+        """
+        Encode the message for another connection and window, without laying it out again
+
+        The frames are encoded once and only the connection id and window id are changed per recipient
+
+        :param connection_id: the recipient's connection
+        :param window_id: the recipient's window, a room if this message is for a room and a buddy otherwise
+        :return: the frames
+        """
+        if (window_id > 0x80) != self.is_room:
+            raise ValueError(f"Invalid window_id {window_id:#04x}: the message was laid out for a "
+                             f"{'room' if self.is_room else 'buddy'} window")
+        if self._frames is None:
+            self._frames = list(self.encode())
+
+        head = bytes((0x80 | connection_id, window_id))
+        frames = [head + frame[2:] for frame in self._frames[:-1]]
+        frames.append(self.END_SCHEMA.encode(connection_id, window_id))
+        return frames
+
+    def __repr__(self) -> str:
+        return f"<SendMessagePacket window: {self.window_id} connection id: {self.connection_id}>"
+
+
+class CreateRoomPacket(TxPacket):
+    connection_id: int
+    room_id: int
+
+    SCHEMA: Final[Schema] = Schema(Connection(0xe0), Opcode(0xc9), Byte("room_id", 0x81, 0x8f), Terminator())
+
+    def __init__(self, connection_id: int, room_id: int) -> None:
+        self.connection_id = connection_id
+        self.room_id = room_id
+
+    def encode(self) -> Iterator[bytes]:
+        yield self.SCHEMA.encode(connection_id=self.connection_id, room_id=self.room_id)
+
+    def __repr__(self) -> str:
+        return f"<CreateRoomPacket room: {self.room_id} connection id: {self.connection_id}>"
+
+
+class InviteRequestPacket(TxPacket):
+    connection_id: int
+    username: str
+
+    SCHEMA: Final[Schema] = Schema(Connection(0xc0), Opcode(0xc3), Text("username"), Terminator())
+
+    def __init__(self, connection_id: int, username: str) -> None:
+        self.connection_id = connection_id
+        self.username = username
+
+    def encode(self) -> Iterator[bytes]:
+        yield self.SCHEMA.encode(connection_id=self.connection_id, username=self.username)
+
+    def __repr__(self) -> str:
+        return f"<InviteRequestPacket username: \"{self.username}\" connection id: {self.connection_id}>"
+
+
+class AddBuddyPacket(TxPacket):
+    """
+    Add a buddy to the handheld's buddy list, the buddy's window id is its buddy_id
+
+    Sending it again for a buddy_id the handheld already has replaces that buddy, which is how status changes are sent.
+    There is no known packet to remove a buddy, removed buddies stay on the handheld
+    """
+    connection_id: int
+    buddy_id: int
+    screen_name: str
+    group: str
+    status: "AddBuddyPacket.Status"
+    mobile: bool
+
+    class Status(Enum):
+        Active = "A"
+        Idle = "I"
+        Away = "U"
+
+    STATUS_SCHEMA: Final[Schema] = Schema(Connection(0xe0), Opcode(0xca), Text("status", length=3),
+                                          Byte("buddy_id", 0x01, 0x80), Terminator())
+    NAME_SCHEMA: Final[Schema] = Schema(Connection(0xc0), Opcode(0xc9), Text("group", length=6), Text("screen_name"),
+                                        Terminator())
+    END_SCHEMA: Final[Schema] = Schema(Connection(0xa0), Opcode(0xc9), Opcode(0x01), Terminator())
+
+    def __init__(self, connection_id: int, buddy_id: int, screen_name: str, group: str,
+                 status: "AddBuddyPacket.Status" = Status.Active, mobile: bool = False) -> None:
+        self.connection_id = connection_id
+        self.buddy_id = buddy_id
+        self.screen_name = screen_name
+        self.group = group
+        self.status = status
+        self.mobile = mobile
+
+    def encode(self) -> Iterator[bytes]:
+        # status, mobile, and a flag that is always N
+        status = self.status.value + ("Y" if self.mobile else "N") + "N"
+        yield self.STATUS_SCHEMA.encode(self.connection_id, status, self.buddy_id)
+        yield self.NAME_SCHEMA.encode(self.connection_id, transliterate(self.group), transliterate(self.screen_name))
+        yield self.END_SCHEMA.encode(self.connection_id)
+
+    def __repr__(self) -> str:
+        return f"<AddBuddyPacket buddy: {self.buddy_id} \"{self.screen_name}\" connection id: {self.connection_id}>"
@@ -0,0 +1,134 @@
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from typing import Dict, List, Optional, Tuple, Final
+
+from mx240a.handheld import BuddyStatus
+
+
+class _PendingPresence:
+    """The latest status of a buddy, waiting for its coalescing window to end"""
+    first_change: float
+    status: BuddyStatus
+    mobile: bool
+
+    def __init__(self, first_change: float, status: BuddyStatus, mobile: bool) -> None:
+        self.first_change = first_change
+        self.status = status
+        self.mobile = mobile
+
+
+class _TokenBucket:
+    tokens: float
+    last_refill: float
+
+    def __init__(self, tokens: float, now: float) -> None:
+        self.tokens = tokens
+        self.last_refill = now
+
+
+class PresenceDebouncer:
+    """
+    Coalesces buddy status changes so a flapping buddy costs one update, or none if it ends up where it started
+
+    A buddy's changes are collected for window seconds after the first one, then only the last status is due. Due
+    updates are rate limited per connection with a token bucket, updates over the limit wait, oldest first.
+    Changes can come from any thread, due() is called by the driver.
+    """
+    window: float
+    rate: float
+    burst: int
+    _pending: Dict[int, "OrderedDict[str, _PendingPresence]"]
+    _buckets: Dict[int, _TokenBucket]
+    _lock: Lock
+
+    DEFAULT_WINDOW_S: Final[float] = 3.0
+    DEFAULT_RATE: Final[float] = 0.5
+    DEFAULT_BURST: Final[int] = 4
+
+    def __init__(self, window: float = DEFAULT_WINDOW_S, rate: float = DEFAULT_RATE,
+                 burst: int = DEFAULT_BURST) -> None:
+        """
+        :param window: seconds to collect a buddy's changes for
+        :param rate: updates per second per connection
+        :param burst: updates a connection can send at once after being quiet
+        """
+        self.window = window
+        self.rate = rate
+        self.burst = burst
+        self._pending = {}
+        self._buckets = {}
+        self._lock = Lock()
+
+    def update(self, connection_id: int, screen_name: str, status: BuddyStatus, mobile: bool,
+               now: Optional[float] = None) -> None:
+        """
+        Record a buddy's new status
+
+        :param connection_id: the handheld's connection
+        :param screen_name: the buddy
+        :param status: the buddy's status
+        :param mobile: if the buddy is on a mobile device
+        :param now: the current monotonic time
+        """
+        if now is None:
+            now = monotonic()
+        with self._lock:
+            pending = self._pending.setdefault(connection_id, OrderedDict())
+            if entry := pending.get(screen_name):
+                # keep the window from the first change, so constant flapping still gets through
+                entry.status = status
+                entry.mobile = mobile
+            else:
+                pending[screen_name] = _PendingPresence(now, status, mobile)
+
+    def due(self, now: Optional[float] = None) -> List[Tuple[int, str, BuddyStatus, bool]]:
+        """
+        Take the updates whose window has ended, as far as each connection's rate limit allows
+
+        Whether an update is a net change is up to the caller, which knows what the handheld shows
+
+        :param now: the current monotonic time
+        :return: (connection_id, screen_name, status, mobile) for every update to send
+        """
+        if now is None:
+            now = monotonic()
+        result = []
+        with self._lock:
+            for connection_id, pending in self._pending.items():
+                bucket = self._buckets.get(connection_id)
+                if bucket is None:
+                    bucket = self._buckets[connection_id] = _TokenBucket(self.burst, now)
+                else:
+                    bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.last_refill) * self.rate)
+                    bucket.last_refill = now
+
+                # oldest first, stop at the first one still in its window
+                while pending and bucket.tokens >= 1:
+                    screen_name, entry = next(iter(pending.items()))
+                    if now - entry.first_change < self.window:
+                        break
+                    del pending[screen_name]
+                    bucket.tokens -= 1
+                    result.append((connection_id, screen_name, entry.status, entry.mobile))
+        return result
+
+    def refund(self, connection_id: int) -> None:
+        """
+        Give back the rate limit token of a due update that turned out not to be a change
+
+        :param connection_id: the handheld's connection
+        """
+        with self._lock:
+            if bucket := self._buckets.get(connection_id):
+                bucket.tokens = min(self.burst, bucket.tokens + 1)
+
+    def drop_connection(self, connection_id: int) -> None:
+        """Forget the pending updates of a disconnected handheld"""
+        with self._lock:
+            self._pending.pop(connection_id, None)
+            self._buckets.pop(connection_id, None)
+
+    def __bool__(self) -> bool:
+        with self._lock:
+            return any(self._pending.values())
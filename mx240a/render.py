@@ -0,0 +1,164 @@
+import argparse
+import os
+import sys
+import wave
+from typing import Dict, Final, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError as e:
+    raise ImportError("mx240a.render needs NumPy to synthesize audio, install it with `pip install numpy`") from e
+
+from mx240a.logging import logger
+from mx240a.rtttl import Ringtone, TONE_UNIT_MS, RTTTLError
+from mx240a.tonebank import ToneBank
+
+REST: Final[int] = 0x7f
+SAMPLE_RATE: Final[int] = 22050
+WAVEFORMS: Final[Tuple[str, ...]] = ("square", "sine")
+
+_SEMITONES: Final[Dict[str, int]] = {"c": 0, "d": 2, "e": 4, "f": 5, "g": 7, "a": 9, "b": 11}
+
+
+def _note_frequency(note: str) -> float:
+    """
+    :param note: a note in the NOTE_TO_HEX format, ex: "c4#"
+    :return: the frequency of the note in Hz
+    """
+    midi = 12 * (int(note[1]) + 1) + _SEMITONES[note[0]] + (1 if note.endswith("#") else 0)
+    return 440.0 * 2 ** ((midi - 69) / 12)
+
+
+def _frequency_table() -> "np.ndarray":
+    # 0 for rests and the values the handheld has no known note for (0x18 - 0x1f)
+    table = np.zeros(256, dtype=np.float64)
+    for note, value in Ringtone.NOTE_TO_HEX.items():
+        table[value] = _note_frequency(note)
+    return table
+
+
+FREQUENCIES: Final["np.ndarray"] = _frequency_table()
+
+
+def render_tone(tone_bytes: bytes, sample_rate: int = SAMPLE_RATE, waveform: str = "square",
+                volume: float = 0.5) -> "np.ndarray":
+    """
+    Synthesize a compiled tone
+
+    :param tone_bytes: the tone in the handheld's format, (units, note) pairs
+    :param sample_rate: samples per second
+    :param waveform: "square" or "sine"
+    :param volume: peak amplitude, 0 to 1
+    :return: the samples as float32 between -1 and 1
+    """
+    if waveform not in WAVEFORMS:
+        raise ValueError(f"Unknown waveform {waveform}, expected one of {', '.join(WAVEFORMS)}")
+    if len(tone_bytes) % 2:
+        raise ValueError(f"Tone bytes must be (units, note) pairs, got {len(tone_bytes)} bytes")
+
+    pairs = np.frombuffer(tone_bytes, dtype=np.uint8).reshape(-1, 2)
+    units, notes = pairs[:, 0], pairs[:, 1]
+    frequencies = FREQUENCIES[notes]
+
+    unknown = (frequencies == 0) & (notes != REST)
+    if unknown.any():
+        logger.warning(f"Unknown note values rendered as rests: {sorted(set(notes[unknown].tolist()))}")
+
+    # end of each note in samples, rounded once so the lengths don't drift
+    ends = np.round(np.cumsum(units) * (TONE_UNIT_MS * sample_rate / 1000)).astype(np.int64)
+    lengths = np.diff(ends, prepend=0)
+
+    sample_frequencies = np.repeat(frequencies, lengths)
+    phase = np.cumsum(sample_frequencies / sample_rate)
+    if waveform == "square":
+        samples = np.where(phase % 1.0 < 0.5, 1.0, -1.0)
+    else:
+        samples = np.sin(2 * np.pi * phase)
+    samples[sample_frequencies == 0] = 0.0
+
+    return (samples * volume).astype(np.float32)
+
+
+def write_wav(path: str, samples: "np.ndarray", sample_rate: int = SAMPLE_RATE) -> None:
+    """
+    Write samples to a 16-bit mono WAV file
+
+    :param path: the file to write
+    :param samples: float samples between -1 and 1
+    :param sample_rate: samples per second
+    """
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype("<i2")
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(pcm.tobytes())
+
+
+def render_bank(bank: ToneBank, directory: str, sample_rate: int = SAMPLE_RATE, waveform: str = "square",
+                volume: float = 0.5) -> List[str]:
+    """
+    Render every tone in a tone bank to a WAV file
+
+    Files are named after the tone bank key, with ":" replaced by "_"
+
+    :param bank: the tone bank
+    :param directory: where to write the files
+    :param sample_rate: samples per second
+    :param waveform: "square" or "sine"
+    :param volume: peak amplitude, 0 to 1
+    :return: the files written
+    """
+    written = []
+    for key, entry in bank.entries.items():
+        path = os.path.join(directory, key.replace(":", "_") + ".wav")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        write_wav(path, render_tone(entry.tone_bytes, sample_rate, waveform, volume), sample_rate)
+        written.append(path)
+    return written
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from mx240a.logging import set_log_level
+    set_log_level("WARNING")
+
+    parser = argparse.ArgumentParser(prog="python -m mx240a.render",
+                                     description="Render ringtones to WAV files to hear them without a handheld")
+    parser.add_argument("tone", help="an RTTTL string, a file of RTTTL, or a tone bank (.json)")
+    parser.add_argument("-o", "--output", required=True,
+                        help="WAV file to write, or a directory for a whole tone bank")
+    parser.add_argument("-k", "--key", help="render only this tone bank key")
+    parser.add_argument("-w", "--waveform", choices=WAVEFORMS, default="square")
+    parser.add_argument("-r", "--rate", type=int, default=SAMPLE_RATE, help="sample rate")
+    parser.add_argument("-v", "--volume", type=float, default=0.5, help="peak amplitude, 0 to 1")
+    args = parser.parse_args(argv)
+
+    if args.tone.endswith(".json"):
+        bank = ToneBank.load(args.tone)
+        if args.key is None:
+            written = render_bank(bank, args.output, args.rate, args.waveform, args.volume)
+            print(f"{len(written)} tones rendered to {args.output}")
+            return 0
+        if args.key not in bank:
+            print(f"No tone {args.key} in {args.tone}", file=sys.stderr)
+            return 1
+        tone_bytes = bank.entries[args.key].tone_bytes
+    else:
+        tone_data = args.tone
+        if os.path.isfile(tone_data):
+            with open(tone_data) as f:
+                tone_data = f.read().strip()
+        try:
+            tone_bytes = Ringtone(tone_data).tone_bytes
+        except RTTTLError as e:
+            print(e, file=sys.stderr)
+            return 1
+
+    samples = render_tone(tone_bytes, args.rate, args.waveform, args.volume)
+    write_wav(args.output, samples, args.rate)
+    print(f"Rendered {len(samples) / args.rate:.2f}s to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
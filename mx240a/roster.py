@@ -0,0 +1,219 @@
+from collections import OrderedDict
+from typing import Dict, Set, Final, List
+
+from mx240a.handheld import Handheld, Buddy, BuddyStatus, Window
+
+
+class Contact:
+    """
+    A contact in the full roster, which may or may not be on the handheld
+
+    pinned: always kept on the handheld
+    """
+    screen_name: str
+    group: str
+    status: BuddyStatus
+    mobile: bool
+    pinned: bool
+
+    def __init__(self, screen_name: str, group: str, status: BuddyStatus = BuddyStatus.Active, mobile: bool = False,
+                 pinned: bool = False) -> None:
+        self.screen_name = screen_name
+        self.group = group
+        self.status = status
+        self.mobile = mobile
+        self.pinned = pinned
+
+    def __repr__(self) -> str:
+        pinned = " pinned" if self.pinned else ""
+        return f"<Contact \"{self.screen_name}\" group: \"{self.group}\" {self.status.name}{pinned}>"
+
+
+class VirtualRoster:
+    """
+    Keeps a roster of any size and puts only a working set of it on a handheld's buddy list
+
+    The working set is the pinned contacts plus the most recently used others, up to capacity. Contacts are added to
+    the handheld when they are used (touch, a message, the user opening their window) and the least recently used
+    unpinned contact is evicted to make room.
+
+    There is no known packet to remove a buddy, so the contact coming in takes the evicted buddy's id and replaces it
+    on the handheld. The handheld's list never grows past capacity.
+
+    Make a roster per Handheld, e.g. in Service.login. Buddies the handheld already has (adopted from its last
+    session) start out as the least recently used part of the working set, so they are replaced first. The roster
+    holds the handheld's lock, so it can be used from any thread.
+    """
+    handheld: Handheld
+    capacity: int
+    contacts: Dict[str, Contact]
+    # unpinned contacts on the handheld, least recently used first
+    _recent: "OrderedDict[str, None]"
+    _pinned: Set[str]
+
+    DEFAULT_CAPACITY: Final[int] = 32
+
+    def __init__(self, handheld: Handheld, capacity: int = DEFAULT_CAPACITY) -> None:
+        if capacity < 1 or capacity > Handheld.LAST_BUDDY_ID - Handheld.FIRST_BUDDY_ID + 1:
+            raise ValueError(f"Invalid capacity {capacity}")
+        self.handheld = handheld
+        self.capacity = capacity
+        self.contacts = {}
+        self._recent = OrderedDict((screen_name, None) for screen_name in handheld.buddies_by_name)
+        self._pinned = set()
+
+    def set_contact(self, screen_name: str, group: str, status: BuddyStatus = BuddyStatus.Active,
+                    mobile: bool = False, pinned: bool = False) -> Contact:
+        """
+        Add a contact to the roster, or update it
+
+        Pinned contacts are put on the handheld right away, others when they are first used. Changes to a contact
+        already on the handheld are sent to it
+
+        :return: the contact
+        """
+        with self.handheld.lock:
+            contact = self.contacts.get(screen_name)
+            if contact is None:
+                contact = self.contacts[screen_name] = Contact(screen_name, group, status, mobile, pinned)
+            else:
+                contact.group = group
+                contact.status = status
+                contact.mobile = mobile
+                if pinned != contact.pinned:
+                    self._set_pinned(contact, pinned)
+                if screen_name in self:
+                    self.handheld.update_buddy(screen_name, group, status, mobile)
+
+            if pinned:
+                self.touch(screen_name)
+            return contact
+
+    def remove_contact(self, screen_name: str) -> Contact:
+        """
+        Remove a contact from the roster, and from the working set if it is on the handheld
+
+        :return: the removed contact
+        """
+        with self.handheld.lock:
+            contact = self.contacts.pop(screen_name, None)
+            if contact is None:
+                raise ValueError(f"No contact {screen_name}")
+            self._pinned.discard(screen_name)
+            self._recent.pop(screen_name, None)
+            if self.handheld.find_buddy(screen_name):
+                self.handheld.remove_buddy(screen_name)
+            return contact
+
+    def pin(self, screen_name: str) -> Buddy:
+        """
+        Keep a contact on the handheld until it is unpinned
+
+        :return: the contact's buddy
+        """
+        with self.handheld.lock:
+            self._set_pinned(self._contact(screen_name), True)
+            return self.touch(screen_name)
+
+    def unpin(self, screen_name: str) -> None:
+        """Let a contact be evicted again, it becomes the most recently used"""
+        with self.handheld.lock:
+            self._set_pinned(self._contact(screen_name), False)
+
+    def touch(self, screen_name: str) -> Buddy:
+        """
+        Mark a contact as used, putting it on the handheld if it is not there yet
+
+        :return: the contact's buddy
+        """
+        with self.handheld.lock:
+            contact = self._contact(screen_name)
+            if screen_name in self._recent:
+                self._recent.move_to_end(screen_name)
+                return self.handheld.buddies_by_name[screen_name]
+            if screen_name in self._pinned:
+                return self.handheld.buddies_by_name[screen_name]
+
+            if screen_name in self.handheld.buddies_by_name:
+                # added to the handheld outside of the roster, take it over
+                self.handheld.update_buddy(screen_name, contact.group, contact.status, contact.mobile)
+                self._add_to_working_set(contact)
+                while len(self) > self.capacity:
+                    self._evict()
+                return self.handheld.buddies_by_name[screen_name]
+
+            # an adopted buddy list can be over capacity, the first evicted buddy is replaced by this one
+            buddy_id = None
+            while len(self) >= self.capacity:
+                evicted = self._evict()
+                if buddy_id is None:
+                    buddy_id = evicted
+            buddy = self.handheld.add_buddy(
+                contact.screen_name, contact.group, contact.status, contact.mobile, buddy_id
+            )
+            self._add_to_working_set(contact)
+            return buddy
+
+    def window_opened(self, window: Window) -> None:
+        """
+        Call from Service.window_opened so navigating counts as using the contact
+
+        :param window: the opened window
+        """
+        with self.handheld.lock:
+            if window.buddy is not None and window.buddy.screen_name in self.contacts:
+                self.touch(window.buddy.screen_name)
+
+    def fill(self) -> List[Buddy]:
+        """
+        Fill the free part of the working set with contacts that are not away, in roster order
+
+        For a freshly logged in handheld, afterwards contacts come and go as they are used
+
+        :return: the buddies added
+        """
+        with self.handheld.lock:
+            added = []
+            for contact in self.contacts.values():
+                if len(self) >= self.capacity:
+                    break
+                if contact.status != BuddyStatus.Away and contact.screen_name not in self:
+                    added.append(self.touch(contact.screen_name))
+            return added
+
+    def _contact(self, screen_name: str) -> Contact:
+        contact = self.contacts.get(screen_name)
+        if contact is None:
+            raise ValueError(f"No contact {screen_name}")
+        return contact
+
+    def _add_to_working_set(self, contact: Contact) -> None:
+        if contact.pinned:
+            self._pinned.add(contact.screen_name)
+        else:
+            self._recent[contact.screen_name] = None
+
+    def _set_pinned(self, contact: Contact, pinned: bool) -> None:
+        contact.pinned = pinned
+        name = contact.screen_name
+        if pinned and name in self._recent:
+            del self._recent[name]
+            self._pinned.add(name)
+        elif not pinned and name in self._pinned:
+            self._pinned.remove(name)
+            self._recent[name] = None
+
+    def _evict(self) -> int:
+        """
+        :return: the evicted buddy's id, for the contact replacing it
+        """
+        if not self._recent:
+            raise RuntimeError("Working set is full of pinned contacts")
+        screen_name, _ = self._recent.popitem(last=False)
+        return self.handheld.remove_buddy(screen_name).buddy_id
+
+    def __contains__(self, screen_name: str) -> bool:
+        return screen_name in self._recent or screen_name in self._pinned
+
+    def __len__(self) -> int:
+        return len(self._recent) + len(self._pinned)
@@ -1,5 +1,5 @@
-from typing import Dict, Final, Optional
-import re
+from functools import lru_cache
+from typing import Dict, Final, Optional, Tuple, List, FrozenSet
 
 from mx240a.logging import logger
 from mx240a.util import hexdump
@@ -67,62 +67,379 @@ class Ringtone:
 
         if not tone_data:
             # null tone data = mute
-            self.tone_bytes = bytes([0x01, 0x7f])
+            self.tone_bytes = MUTE_TONE_BYTES
             return
 
-        logger.trace(f"RTTTL Input \"{tone_data}\"")
-        duration = 4
-        octave = 4
-        bpm = 120
-
-        tone_data = tone_data.replace(" ", "")
-        if not (match := re.match(R"(.*):(([dob]=\d+,?)*):(.*)", tone_data)):
-            raise ValueError("Invalid RTTTL Data")
-
-        name = match.group(1)
-        args = match.group(2)
-        notes = match.group(4)
-
-        for arg in args.split(","):
-            parts = arg.split("=")
-            if parts[0] == "d":
-                new_duration = int(parts[1])
-                if new_duration not in [1, 2, 4, 8, 16, 32]:
-                    raise ValueError("Invalid RTTTL Data (Invalid duration)")
-                duration = new_duration
-            elif parts[0] == "o":
-                new_octave = int(parts[1])
-                if new_octave not in [4, 5, 6, 7]:
-                    raise ValueError("Invalid RTTTL Data (Invalid octave)")
-                octave = new_octave
-            elif parts[0] == "b":
-                bpm = int(parts[1])
-
-        logger.trace(f"RTTTL: \"{name}\" (Note Duration: {duration}, Octave: {octave}, BPM: {bpm}) Notes: {notes}")
+        normalized = tone_data.replace(" ", "")
+        if normalized in _PRECOMPILED:
+            self.name, self.tone_bytes = _PRECOMPILED[normalized]
+        else:
+            self.name, self.tone_bytes = _compile(normalized)
+
+    @classmethod
+    def from_bytes(cls, tone_bytes: bytes, name: str = "", tone_data: Optional[str] = None) -> "Ringtone":
+        """
+        Create a ringtone from already encoded tone bytes
+
+        :param tone_bytes: the encoded tone
+        :param name: name of the tone
+        :param tone_data: the RTTTL the tone was encoded from, if known
+        :return: the ringtone
+        """
+        tone = cls.__new__(cls)
+        tone.tone_data = tone_data
+        tone.name = name
+        tone.tone_bytes = bytes(tone_bytes)
+        return tone
+
+    def __repr__(self) -> str:
+        return f"<Ringtone \"{self.tone_data}\">"
+
+
+# null tone data = mute, the "mute tone" just plays a very short rest
+MUTE_TONE_BYTES: Final[bytes] = bytes([0x01, 0x7f])
+
+
+class RTTTLError(ValueError):
+    """
+    Invalid RTTTL
+
+    errors: every problem found, as (position, message)
+    """
+    errors: List[Tuple[int, str]]
+
+    def __init__(self, errors: List[Tuple[int, str]]) -> None:
+        self.errors = errors
+        super().__init__("Invalid RTTTL Data (%s)" % "; ".join(f"{pos}: {msg}" for pos, msg in errors))
+
+
+class ToneScan:
+    """
+    Result of scanning RTTTL
+
+    name: name of the tone
+    tone_bytes: the tone in the handheld's format
+    note_count: number of notes, including pauses
+    pause_count: number of pauses
+    duration_ms: length of the tone
+    errors: every problem found, as (position, message), the tone is only valid if this is empty
+    """
+    name: str
+    tone_bytes: bytes
+    note_count: int
+    pause_count: int
+    duration_ms: int
+    errors: List[Tuple[int, str]]
+
+    def __init__(self, name: str, tone_bytes: bytes, note_count: int, pause_count: int, duration_ms: int,
+                 errors: List[Tuple[int, str]]) -> None:
         self.name = name
+        self.tone_bytes = tone_bytes
+        self.note_count = note_count
+        self.pause_count = pause_count
+        self.duration_ms = duration_ms
+        self.errors = errors
+
+    def __repr__(self) -> str:
+        return f"<ToneScan \"{self.name}\" notes: {self.note_count} duration: {self.duration_ms}ms " \
+               f"errors: {len(self.errors)}>"
+
+
+_DURATIONS: Final[FrozenSet[int]] = frozenset({1, 2, 4, 8, 16, 32})
+_OCTAVES: Final[FrozenSet[int]] = frozenset({4, 5, 6, 7})
+_SEPARATORS: Final[str] = " \t\r\n"
+# length of one tone time unit in ms
+TONE_UNIT_MS: Final[int] = 16
+
+
+def scan(tone_data: str) -> ToneScan:
+    """
+    Compile RTTTL to the handheld's tone format in a single pass, collecting every error instead of stopping at the first
+
+    :param tone_data: the RTTTL
+    :return: the result, check errors before using tone_bytes
+    """
+    errors: List[Tuple[int, str]] = []
+    text = tone_data
+    end = len(text)
+
+    colon = text.find(":")
+    if colon == -1:
+        return ToneScan("", b"", 0, 0, 0, [(end, "missing ':' after the name")])
+    name = text[:colon].strip()
+
+    duration = 4
+    octave = 4
+    bpm = 120
+
+    # settings, "d=4,o=5,b=120"
+    i = colon + 1
+    while i < end and text[i] != ":":
+        char = text[i]
+        if char in _SEPARATORS or char == ",":
+            i += 1
+            continue
+
+        start = i
+        key = char.lower()
+        i += 1
+        while i < end and text[i] in _SEPARATORS:
+            i += 1
+        if i >= end or text[i] != "=":
+            errors.append((start, f"expected '=' after '{char}'"))
+            while i < end and text[i] not in ",:":
+                i += 1
+            continue
+        i += 1
+        while i < end and text[i] in _SEPARATORS:
+            i += 1
+        num_start = i
+        while i < end and text[i].isdigit():
+            i += 1
+        if i == num_start:
+            errors.append((num_start, f"expected a number for '{char}'"))
+            while i < end and text[i] not in ",:":
+                i += 1
+            continue
+        value = int(text[num_start:i])
+
+        if key == "d":
+            if value not in _DURATIONS:
+                errors.append((num_start, f"invalid duration {value}"))
+            else:
+                duration = value
+        elif key == "o":
+            if value not in _OCTAVES:
+                errors.append((num_start, f"invalid octave {value}"))
+            else:
+                octave = value
+        elif key == "b":
+            if value < 1:
+                errors.append((num_start, f"invalid bpm {value}"))
+            else:
+                bpm = value
+        else:
+            errors.append((start, f"unknown setting '{char}'"))
 
-        output_bytes = bytearray()
-        for match in re.findall(R"(\d?)([a-gA-GpP])(#?)(\d?)(\.?),?", notes):
-            note_duration = int(match[0]) if match[0] else duration
-            note_ms = int(60000 / bpm * 4 / note_duration / 16)
-            if note_ms < 1:
-                note_ms = 1
-            if note_ms > 255:
-                note_ms = 255
-            output_bytes.append(note_ms)
-
-            note = match[1].lower()
-            sharp = match[2] if match[2] else ""
-            note_octave = match[3] if match[3] else octave
+    if i >= end:
+        errors.append((end, "missing ':' before the notes"))
+        return ToneScan(name, b"", 0, 0, 0, errors)
+    i += 1
+
+    # notes, "[duration]note[#][.][octave][.]"
+    output_bytes = bytearray()
+    note_count = 0
+    pause_count = 0
+    total_units = 0
+    while i < end:
+        char = text[i]
+        if char in _SEPARATORS or char == ",":
+            i += 1
+            continue
+
+        start = i
+        while i < end and text[i].isdigit():
+            i += 1
+        note_duration = int(text[start:i]) if i > start else duration
+        if note_duration not in _DURATIONS:
+            errors.append((start, f"invalid duration {note_duration}"))
+            note_duration = duration
+
+        if i >= end or text[i].lower() not in "abcdefgp":
+            errors.append((i, f"expected a note, got '{text[i]}'" if i < end else "expected a note"))
+            while i < end and text[i] != ",":
+                i += 1
+            continue
+        note = text[i].lower()
+        i += 1
+
+        sharp = ""
+        if i < end and text[i] == "#":
+            sharp = "#"
+            i += 1
+        dotted = False
+        if i < end and text[i] == ".":
+            dotted = True
+            i += 1
+        note_octave = octave
+        if i < end and text[i].isdigit():
+            note_octave = int(text[i])
+            i += 1
+        if i < end and text[i] == ".":
+            dotted = True
+            i += 1
+
+        if i < end and text[i] != "," and text[i] not in _SEPARATORS:
+            errors.append((i, f"unexpected '{text[i]}' in note"))
+            while i < end and text[i] != ",":
+                i += 1
+            continue
+
+        note_ms = 60000 / bpm * 4 / note_duration
+        if dotted:
+            note_ms *= 1.5
+        units = min(max(int(note_ms / TONE_UNIT_MS), 1), 255)
+
+        if note == "p":
+            value = 0x7f
+            pause_count += 1
+        else:
             full_note = f"{note}{note_octave}{sharp}"
-            if full_note not in Ringtone.NOTE_TO_HEX and note != "p":
-                raise ValueError("Invalid RTTTL Data (Invalid note)")
-            elif note == "p":
-                logger.warning("RTTTL WARNING: Pauses do not work correctly on the handset")
-            output_bytes.append(0x7f if note == "p" else Ringtone.NOTE_TO_HEX[full_note])
+            value = Ringtone.NOTE_TO_HEX.get(full_note, 0)
+            if not value:
+                errors.append((start, f"invalid note {full_note}"))
+                continue
+
+        output_bytes.append(units)
+        output_bytes.append(value)
+        note_count += 1
+        total_units += units
+
+    return ToneScan(name, bytes(output_bytes), note_count, pause_count, total_units * TONE_UNIT_MS, errors)
+
+
+@lru_cache(maxsize=256)
+def _compile(tone_data: str) -> Tuple[str, bytes]:
+    """
+    Compile RTTTL to the handheld's tone format
+
+    :param tone_data: RTTTL with spaces removed
+    :return: the name and tone bytes
+    """
+    logger.trace(f"RTTTL Input \"{tone_data}\"")
+    result = scan(tone_data)
+    if result.errors:
+        raise RTTTLError(result.errors)
+    if result.pause_count:
+        logger.warning("RTTTL WARNING: Pauses do not work correctly on the handset")
+    logger.trace(f"RTTTL Output {hexdump(result.tone_bytes)}")
+    return result.name, result.tone_bytes
+
+
+class OptimizedTone:
+    """
+    A tone shortened for sending to the handheld
 
-        self.tone_bytes = bytes(output_bytes)
-        logger.trace(f"RTTTL Output {hexdump(self.tone_bytes)}")
+    tone_bytes: the optimized tone
+    merged_notes: number of notes merged into the note before them
+    dropped_notes: number of notes cut off to fit the length limit
+    dropped_ms: length of the notes cut off
+    duration_ms: length of the optimized tone
+    """
+    tone_bytes: bytes
+    merged_notes: int
+    dropped_notes: int
+    dropped_ms: int
+    duration_ms: int
+
+    def __init__(self, tone_bytes: bytes, merged_notes: int, dropped_notes: int, dropped_ms: int,
+                 duration_ms: int) -> None:
+        self.tone_bytes = tone_bytes
+        self.merged_notes = merged_notes
+        self.dropped_notes = dropped_notes
+        self.dropped_ms = dropped_ms
+        self.duration_ms = duration_ms
+
+    @property
+    def fidelity(self) -> float:
+        """Fraction of the original tone's length that is kept"""
+        total = self.duration_ms + self.dropped_ms
+        return self.duration_ms / total if total else 1.0
 
     def __repr__(self) -> str:
-        return f"<Ringtone \"{self.tone_data}\">"
+        return f"<OptimizedTone bytes: {len(self.tone_bytes)} merged: {self.merged_notes} " \
+               f"dropped: {self.dropped_notes} ({self.dropped_ms}ms)>"
+
+
+def optimize_tone(tone_bytes: bytes, max_bytes: Optional[int] = None, merge_notes: bool = False) -> OptimizedTone:
+    """
+    Shorten a tone: merge adjacent rests, as long as the merged length still fits in a byte, then cut the tone off
+    at max_bytes
+
+    :param tone_bytes: the tone
+    :param max_bytes: longest tone allowed, None for no limit
+    :param merge_notes: also merge adjacent notes of the same pitch. Repeated notes become one long note, which sounds
+        different unless the handheld plays notes without a gap, which is not known
+    :return: the optimized tone
+    """
+    output_bytes = bytearray()
+    merged = 0
+    for i in range(0, len(tone_bytes) - 1, 2):
+        units = tone_bytes[i]
+        value = tone_bytes[i + 1]
+        if output_bytes and output_bytes[-1] == value and (merge_notes or value == 0x7f) \
+                and output_bytes[-2] + units <= 255:
+            output_bytes[-2] += units
+            merged += 1
+        else:
+            output_bytes.append(units)
+            output_bytes.append(value)
+
+    dropped_notes = 0
+    dropped_units = 0
+    if max_bytes is not None and len(output_bytes) > max_bytes:
+        cut = max_bytes - max_bytes % 2
+        dropped = output_bytes[cut:]
+        dropped_notes = len(dropped) // 2
+        dropped_units = sum(dropped[0::2])
+        del output_bytes[cut:]
+
+    return OptimizedTone(bytes(output_bytes), merged, dropped_notes, dropped_units * TONE_UNIT_MS,
+                         sum(output_bytes[0::2]) * TONE_UNIT_MS)
+
+
+# Copied all these ringtones from the original MX240a driver
+# (including the names (no i dont know why its called bulletme (also these are really annoying)))
+# RTTTL, pre-encoded tone bytes
+# noinspection SpellCheckingInspection
+_DEFAULT_TONES: Final[Dict[str, Tuple[str, bytes]]] = {
+    "new_message": (  # aol-imrcv.txt
+        "Dang:d=4,o=5,b=140:16g#5,16e5,16c#5",
+        b"\x06\x15\x06\x11\x06\x0e",
+    ),
+    "contact_online": (  # aol_ring.txt
+        "Rikasmiesjos:d=4,o=5,b=100:32b,32d6,32g6,32g6",
+        b"\x04\x20\x04\x23\x04\x28\x04\x28",
+    ),
+    "contact_offline": (  # bolero.txt
+        "Bolero:d=4,o=5,b=80:c6",
+        b"\x2e\x21",
+    ),
+    "message_sent": (  # aol-imsend.txt
+        "Dang:d=4,o=5,b=140:16b5,16e5,16g#5",
+        b"\x06\x20\x06\x11\x06\x15",
+    ),
+    "service_disconnected": (  # aol_urgent.txt
+        "Dang:d=16,o=6,b=200:c,e,d7,c,e,a#,c,e",
+        b"\x04\x21\x04\x25\x04\x2f\x04\x21\x04\x25\x04\x2b\x04\x21\x04\x25",
+    ),
+    "service_connected": (  # bulletme.txt
+        "Bulletme:d=4,o=5,b=112:b.5,g.5",
+        b"\x32\x20\x32\x14",
+    ),
+    "out_of_range": (  # aol-outofrange.txt
+        "Dang:d=4,o=5,b=140:4c,8g,8g,8a,4g,2b,c",
+        b"\x1a\x0d\x0d\x14\x0d\x14\x0d\x16\x1a\x14\x35\x20\x1a\x0d",
+    ),
+    "return_to_in_range": (  # aol_in_range.txt
+        "Dang:d=32,o=7,b=180:d#,e,g,d#,g,d#,f#,e",
+        b"\x02\x30\x02\x31\x02\x34\x02\x30\x02\x34\x02\x30\x02\x33\x02\x31",
+    ),
+    "enter_sleep_mode": (  # aol_sleep.txt
+        "Dang:d=4,o=5,b=80:8e,8c,4f,4e,4d,4c",
+        b"\x17\x11\x17\x0d\x2e\x12\x2e\x11\x2e\x0f\x2e\x0d",
+    ),
+}
+
+# normalized RTTTL -> (name, tone bytes), checked before compiling
+_PRECOMPILED: Final[Dict[str, Tuple[str, bytes]]] = {
+    tone_data.replace(" ", ""): (tone_data.split(":", 1)[0], tone_bytes)
+    for tone_data, tone_bytes in _DEFAULT_TONES.values()
+}
+
+DEFAULT_TONES: Final[Dict[str, Ringtone]] = {
+    tone_name: Ringtone.from_bytes(tone_bytes, tone_data.split(":", 1)[0], tone_data)
+    for tone_name, (tone_data, tone_bytes) in _DEFAULT_TONES.items()
+}
+
+MUTE_TONE: Final[Ringtone] = Ringtone(None)
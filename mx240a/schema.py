@@ -0,0 +1,223 @@
+from typing import List, Optional, Callable, Any, Dict
+
+from mx240a.charset import CODEC_NAME
+from mx240a.util import as_bytes
+
+
+class Field:
+    """A field of a packet layout"""
+    name: Optional[str] = None
+    # number of bytes, None if variable
+    size: Optional[int] = 1
+
+    def encode_check(self) -> List[str]:
+        """:return: lines of code validating the argument"""
+        return []
+
+    def encode_expr(self) -> str:
+        """:return: expression producing an int (for single bytes) or a bytes object"""
+        raise NotImplementedError
+
+    def decode_expr(self, offset: int) -> Optional[str]:
+        """:return: expression reading the field from raw starting at offset"""
+        return None
+
+
+class Connection(Field):
+    """The handheld connection id, or'ed into the high nibble of the byte"""
+    name = "connection_id"
+
+    def __init__(self, high: int) -> None:
+        self.high = high
+
+    def encode_check(self) -> List[str]:
+        return [
+            "if connection_id > 7 or connection_id < 1:",
+            "    raise ValueError(\"Invalid connection_id\")",
+        ]
+
+    def encode_expr(self) -> str:
+        return f"{self.high:#04x} | connection_id"
+
+    def decode_expr(self, offset: int) -> str:
+        return f"raw[{offset}] & 0xf"
+
+
+class Opcode(Field):
+    """A constant byte"""
+
+    def __init__(self, value: int) -> None:
+        self.value = value
+
+    def encode_expr(self) -> str:
+        return f"{self.value:#04x}"
+
+
+class Byte(Field):
+    """A single byte value"""
+
+    def __init__(self, name: str, minimum: int = 0x00, maximum: int = 0xff) -> None:
+        self.name = name
+        self.minimum = minimum
+        self.maximum = maximum
+
+    def encode_check(self) -> List[str]:
+        return [
+            f"if {self.name} > {self.maximum:#04x} or {self.name} < {self.minimum:#04x}:",
+            f"    raise ValueError(\"Invalid {self.name}\")",
+        ]
+
+    def encode_expr(self) -> str:
+        return self.name
+
+    def decode_expr(self, offset: int) -> str:
+        return f"raw[{offset}]"
+
+
+class Text(Field):
+    """
+    Text in the handheld's character set
+
+    length: fixed length, shorter text is padded with spaces and longer text is cut off
+    max_length: maximum length of variable length text
+    """
+
+    def __init__(self, name: str, length: Optional[int] = None, max_length: Optional[int] = None) -> None:
+        self.name = name
+        self.size = length
+        self.max_length = max_length
+
+    def encode_check(self) -> List[str]:
+        lines = [f"{self.name} = as_bytes({self.name})"]
+        if self.max_length is not None:
+            lines += [
+                f"if len({self.name}) > {self.max_length}:",
+                f"    raise ValueError(\"Invalid {self.name}: too long\")",
+            ]
+        return lines
+
+    def encode_expr(self) -> str:
+        if self.size is None:
+            return self.name
+        return f"{self.name}[:{self.size}].ljust({self.size}, b\" \")"
+
+    def decode_expr(self, offset: int) -> str:
+        end = "" if self.size is None else offset + self.size
+        return f"bytes(raw[{offset}:{end}]).partition(b\"\\xff\")[0].decode(CODEC_NAME, \"replace\")"
+
+
+class Data(Field):
+    """Raw bytes, variable length"""
+    size = None
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def encode_expr(self) -> str:
+        return f"bytes({self.name})"
+
+    def decode_expr(self, offset: int) -> str:
+        return f"bytes(raw[{offset}:]).partition(b\"\\xff\")[0]"
+
+
+class Hex(Field):
+    """Fixed length bytes, shown as a hex string"""
+
+    def __init__(self, name: str, length: int) -> None:
+        self.name = name
+        self.size = length
+
+    def encode_expr(self) -> str:
+        return f"bytes.fromhex({self.name})"
+
+    def encode_check(self) -> List[str]:
+        return [
+            f"if len({self.name}) != {self.size * 2}:",
+            f"    raise ValueError(\"Invalid {self.name}\")",
+        ]
+
+    def decode_expr(self, offset: int) -> str:
+        return f"bytes(raw[{offset}:{offset + self.size}]).hex()"
+
+
+class Terminator(Opcode):
+    """The 0xff that ends a packet"""
+
+    def __init__(self) -> None:
+        super().__init__(0xff)
+
+
+class Schema:
+    """
+    Declarative layout of a packet
+
+    Specialized encode and decode functions are generated from the fields once, when the schema is created:
+        encode(**fields) -> bytes: validate the fields and build the packet
+        decode(packet, raw): set the fields as attributes on packet, read from the raw data
+
+    Only one variable length field is allowed, and nothing but the terminator may follow it.
+    """
+    fields: List[Field]
+    encode: Callable[..., bytes]
+    decode: Callable[[Any, bytes], None]
+    source: str
+
+    def __init__(self, *fields: Field) -> None:
+        self.fields = list(fields)
+
+        variable = [i for i, f in enumerate(self.fields) if f.size is None]
+        if len(variable) > 1 or (variable and any(not isinstance(f, Terminator) for f in self.fields[variable[0] + 1:])):
+            raise ValueError("Only the last field before the terminator may be variable length")
+
+        namespace: Dict[str, Any] = {"as_bytes": as_bytes, "CODEC_NAME": CODEC_NAME}
+        self.source = self._encoder_source() + "\n" + self._decoder_source()
+        exec(compile(self.source, f"<schema {self!r}>", "exec"), namespace)
+        self.encode = namespace["encode"]
+        self.decode = namespace["decode"]
+
+    def _encoder_source(self) -> str:
+        args = [f.name for f in self.fields if f.name]
+        lines = [f"def encode({', '.join(args)}):"]
+        for f in self.fields:
+            lines += [f"    {line}" for line in f.encode_check()]
+
+        # merge runs of single bytes into one bytes((...)) call, or a literal if they are all constant
+        parts: List[str] = []
+        run: List[Field] = []
+        for f in self.fields + [None]:
+            if f is not None and f.size == 1:
+                run.append(f)
+                continue
+            if run and all(isinstance(r, Opcode) for r in run):
+                parts.append(repr(bytes(r.value for r in run)))
+            elif run:
+                parts.append(f"bytes(({', '.join(r.encode_expr() for r in run)},))")
+            run = []
+            if f is not None:
+                parts.append(f.encode_expr())
+
+        if len(parts) == 1:
+            lines.append(f"    return {parts[0]}")
+        else:
+            lines.append(f"    return b\"\".join(({', '.join(parts)}))")
+        return "\n".join(lines) + "\n"
+
+    def _decoder_source(self) -> str:
+        lines = ["def decode(packet, raw):"]
+        minimum = sum(f.size for f in self.fields if f.size is not None and not isinstance(f, Terminator))
+        lines += [
+            f"    if len(raw) < {minimum}:",
+            f"        raise ValueError(\"Invalid packet: too short\")",
+        ]
+        offset = 0
+        for f in self.fields:
+            expr = f.decode_expr(offset)
+            if f.name and expr:
+                lines.append(f"    packet.{f.name} = {expr}")
+            if f.size is None:
+                break
+            offset += f.size
+        return "\n".join(lines) + "\n"
+
+    def __repr__(self) -> str:
+        return f"<Schema {' '.join(type(f).__name__ for f in self.fields)}>"
@@ -0,0 +1,186 @@
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple, Optional, Iterator, Final
+
+from mx240a.rtttl import Ringtone, scan
+
+
+class ToneBankEntry:
+    """
+    A compiled tone in a tone bank
+
+    name: name of the tone from the RTTTL
+    tone_bytes: the tone in the handheld's format
+    duration_ms: length of the tone
+    note_count: number of notes, including pauses
+    source: file (and line) the tone was compiled from
+    """
+    name: str
+    tone_bytes: bytes
+    duration_ms: int
+    note_count: int
+    source: str
+
+    def __init__(self, name: str, tone_bytes: bytes, duration_ms: int, note_count: int, source: str) -> None:
+        self.name = name
+        self.tone_bytes = tone_bytes
+        self.duration_ms = duration_ms
+        self.note_count = note_count
+        self.source = source
+
+    def as_ringtone(self) -> Ringtone:
+        return Ringtone.from_bytes(self.tone_bytes, self.name)
+
+    def __repr__(self) -> str:
+        return f"<ToneBankEntry \"{self.name}\" notes: {self.note_count} duration: {self.duration_ms}ms>"
+
+
+class ToneBank:
+    """
+    An on-disk index of compiled tones, keyed by the path of the RTTTL file relative to the library without the extension
+
+    Files with more than one tone get one key per tone, "path:line"
+    """
+    entries: Dict[str, ToneBankEntry]
+
+    VERSION: Final[int] = 1
+
+    def __init__(self, entries: Optional[Dict[str, ToneBankEntry]] = None) -> None:
+        self.entries = entries if entries is not None else {}
+
+    def __getitem__(self, key: str) -> Ringtone:
+        return self.entries[key].as_ringtone()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def save(self, path: str) -> None:
+        data = {
+            "version": ToneBank.VERSION,
+            "tones": {
+                key: {
+                    "name": entry.name,
+                    "tone": entry.tone_bytes.hex(),
+                    "duration_ms": entry.duration_ms,
+                    "notes": entry.note_count,
+                    "source": entry.source,
+                }
+                for key, entry in sorted(self.entries.items())
+            },
+        }
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, indent=1)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def load(path: str) -> "ToneBank":
+        with open(path) as f:
+            data = json.load(f)
+        if data.get("version") != ToneBank.VERSION:
+            raise ValueError(f"Unsupported tone bank version {data.get('version')}")
+        return ToneBank({
+            key: ToneBankEntry(tone["name"], bytes.fromhex(tone["tone"]), tone["duration_ms"], tone["notes"],
+                               tone["source"])
+            for key, tone in data["tones"].items()
+        })
+
+
+# (key, entry or None, errors as (source, message))
+_FileResult = List[Tuple[str, Optional[ToneBankEntry], List[Tuple[str, str]]]]
+
+
+def compile_file(path: str, key: str) -> _FileResult:
+    """
+    Compile every tone in an RTTTL file
+
+    :param path: the file
+    :param key: tone bank key for the file
+    :return: a (key, entry, errors) tuple per tone, entry is None if the tone has errors
+    """
+    try:
+        with open(path, encoding="latin-1") as f:
+            lines = [(n, line.strip()) for n, line in enumerate(f, 1) if line.strip()]
+    except OSError as e:
+        return [(key, None, [(path, str(e))])]
+
+    results: _FileResult = []
+    for line_num, line in lines:
+        tone_key = key if len(lines) == 1 else f"{key}:{line_num}"
+        source = f"{path}:{line_num}"
+        result = scan(line)
+        if result.errors:
+            results.append((tone_key, None, [(f"{source}:{pos + 1}", msg) for pos, msg in result.errors]))
+        else:
+            entry = ToneBankEntry(result.name, result.tone_bytes, result.duration_ms, result.note_count, source)
+            results.append((tone_key, entry, []))
+    return results
+
+
+def _compile_file_args(args: Tuple[str, str]) -> _FileResult:
+    return compile_file(*args)
+
+
+def _find_files(directory: str, extensions: Tuple[str, ...]) -> Iterator[Tuple[str, str]]:
+    for root, _, files in os.walk(directory):
+        for file in sorted(files):
+            if file.lower().endswith(extensions):
+                path = os.path.join(root, file)
+                key = os.path.splitext(os.path.relpath(path, directory))[0].replace(os.sep, "/")
+                yield path, key
+
+
+def compile_directory(directory: str, extensions: Tuple[str, ...] = (".txt", ".rtttl", ".rtx"),
+                      workers: Optional[int] = None) -> Tuple[ToneBank, List[Tuple[str, str]]]:
+    """
+    Compile and validate every RTTTL file in a directory (recursively) using a process pool
+
+    :param directory: the tone library
+    :param extensions: file extensions to compile
+    :param workers: number of worker processes, defaults to the number of CPUs
+    :return: the tone bank of every valid tone, and every error found as (file:line:column, message)
+    """
+    files = list(_find_files(directory, extensions))
+    bank = ToneBank()
+    errors: List[Tuple[str, str]] = []
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        chunk_size = max(1, len(files) // ((workers or os.cpu_count() or 1) * 4))
+        for results in pool.map(_compile_file_args, files, chunksize=chunk_size):
+            for key, entry, file_errors in results:
+                if entry:
+                    bank.entries[key] = entry
+                errors.extend(file_errors)
+
+    return bank, errors
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from mx240a.logging import set_log_level
+    set_log_level("WARNING")
+
+    parser = argparse.ArgumentParser(prog="python -m mx240a.tonebank",
+                                     description="Compile and validate a directory of RTTTL files into a tone bank")
+    parser.add_argument("directory", help="directory of RTTTL files")
+    parser.add_argument("-o", "--output", help="tone bank file to write, only validate if not given")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="number of worker processes")
+    args = parser.parse_args(argv)
+
+    bank, errors = compile_directory(args.directory, workers=args.jobs)
+    for source, message in errors:
+        print(f"{source}: {message}", file=sys.stderr)
+
+    if args.output:
+        bank.save(args.output)
+    print(f"{len(bank)} tones compiled, {len(errors)} errors")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+import hashlib
+import json
+import os
+from threading import RLock
+from typing import Dict, Optional
+
+from mx240a.logging import logger
+
+
+class ToneStateStore:
+    """
+    Remembers which tones were last uploaded to each handheld, so unchanged tones are not uploaded again on reconnect
+
+    The handhelds keep their tones while disconnected. State is kept per handheld_id as a hash of each tone, and saved
+    to path as json (or only kept in memory if path is None). One store can be shared by the drivers of several bases.
+    """
+    path: Optional[str]
+    _state: Dict[str, Dict[str, str]]
+    _lock: RLock
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path
+        self._state = {}
+        self._lock = RLock()
+        self.load()
+
+    @staticmethod
+    def digest(tone_bytes: bytes) -> str:
+        return hashlib.blake2b(tone_bytes, digest_size=8).hexdigest()
+
+    def load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                self._state = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Unable to load tone state, all tones will be uploaded: {e}")
+            self._state = {}
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        tmp_path = self.path + ".tmp"
+        with self._lock:
+            try:
+                with open(tmp_path, "w") as f:
+                    json.dump(self._state, f)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                logger.warning(f"Unable to save tone state: {e}")
+
+    def is_current(self, handheld_id: str, tone_name: str, tone_bytes: bytes) -> bool:
+        """
+        :return: whether the handheld already has this tone
+        """
+        return self._state.get(handheld_id, {}).get(tone_name) == self.digest(tone_bytes)
+
+    def update(self, handheld_id: str, tone_name: str, tone_bytes: bytes) -> None:
+        """Record that a tone was uploaded to the handheld"""
+        with self._lock:
+            self._state.setdefault(handheld_id, {})[tone_name] = self.digest(tone_bytes)
+
+    def forget(self, handheld_id: Optional[str] = None) -> None:
+        """
+        Forget the tones of a handheld so they are all uploaded on the next connect
+
+        :param handheld_id: the handheld, or None for all handhelds
+        """
+        with self._lock:
+            if handheld_id is None:
+                self._state.clear()
+            else:
+                self._state.pop(handheld_id, None)
+            self.save()
@@ -0,0 +1,80 @@
+import unicodedata
+from functools import lru_cache
+from typing import Dict, Final
+
+from mx240a.charset import ENCODING_MAP
+
+# closest text the handheld can show for common characters that are not in its character set
+_TRANSLITERATIONS: Final[Dict[str, str]] = {
+    "‘": "'", "’": "'", "‚": "'", "‛": "'", "′": "'",
+    "“": "\"", "”": "\"", "„": "\"", "‟": "\"", "″": "\"",
+    "«": "<<", "»": ">>", "‹": "<", "›": ">",
+    "‐": "-", "‑": "-", "‒": "-", "–": "-", "—": "-", "―": "-", "−": "-",
+    "…": "...", "•": "*", "·": "*", "×": "x", "÷": "/",
+    "←": "<-", "→": "->", "↑": "^", "↓": "v", "↔": "<->", "⇐": "<=", "⇒": "=>",
+    "©": "(c)", "®": "(r)", "™": "TM", "°": "deg",
+    "€": "EUR", "£": "GBP", "¥": "JPY", "¢": "c",
+    "¿": "?", "¡": "!", "§": "S", "¶": "P",
+    "ß": "ss", "æ": "ae", "Æ": "AE", "œ": "oe", "Œ": "OE",
+    "ø": "o", "Ø": "O", "đ": "d", "Đ": "D", "ł": "l", "Ł": "L",
+    "þ": "th", "Þ": "Th", "ð": "d", "Ð": "D", "ı": "i",
+    "\u00a0": " ", "\u2002": " ", "\u2003": " ", "\u2009": " ", "\u202f": " ", "\u3000": " ",
+    "\u2044": "/",
+    # zero width characters and emoji variation selectors
+    "\u200b": "", "\u200c": "", "\u200d": "", "\u2060": "", "\ufeff": "", "\ufe0e": "", "\ufe0f": "",
+}
+
+
+@lru_cache(maxsize=1024)
+def _transliterate_char(code_point: int) -> str:
+    """
+    Find the closest text the handheld can show for a character that is not in the precomputed table
+
+    :param code_point: the character
+    :return: the replacement text
+    """
+    char = chr(code_point)
+
+    # accented letters and compatibility forms (ligatures, fractions, full width...): decompose and strip the accents
+    decomposed = unicodedata.normalize("NFKD", char)
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    if stripped and stripped != char:
+        return stripped.translate(_TABLE)
+
+    category = unicodedata.category(char)
+    if category == "Mn" or category == "Me" or category == "Sk" or category == "Cf":
+        # combining marks, emoji skin tones, formatting
+        return ""
+    if category == "So":
+        # emoji and other symbols, same format as emoji.demojize
+        name = unicodedata.name(char, None)
+        if name:
+            return f":{name.lower().replace(' ', '_').replace('-', '_')}:"
+
+    return "?"
+
+
+class _TransliterationTable(Dict[int, str]):
+    def __missing__(self, code_point: int) -> str:
+        return _transliterate_char(code_point)
+
+
+_TABLE: Final[_TransliterationTable] = _TransliterationTable({
+    **{c: chr(c) for c in ENCODING_MAP},
+    **{ord(c): s for c, s in _TRANSLITERATIONS.items()},
+})
+
+
+@lru_cache(maxsize=512)
+def transliterate(text: str) -> str:
+    """
+    Replace the characters in a string that the handheld cannot show with the closest text it can
+
+    Accents are stripped, punctuation is replaced with its ascii lookalike and emoji become their ":name:".
+
+    :param text: the string
+    :return: the string using only characters in the handheld's character set
+    """
+    if text.isascii():
+        return text
+    return text.translate(_TABLE)
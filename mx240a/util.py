@@ -1,16 +1,32 @@
-from typing import Union
+from typing import Union, Final
+
+from mx240a.charset import CODEC_NAME
+
+# printable ascii stays, everything else shows as "."
+_HEXDUMP_TABLE: Final[bytes] = bytes(b if 32 <= b <= 127 else ord(".") for b in range(256))
 
 
 def as_bytes(string: str) -> bytes:
     """
-    Convert a string to a bytes object containing ascii data
+    Convert a string to a bytes object in the handheld's character set
 
-    :param string: string to encode as ascii
-    :return: ascii bytes of string
+    :param string: string to encode
+    :return: encoded bytes of string, characters the handheld cannot show are replaced with "?"
     """
     if not isinstance(string, str):
         raise ValueError("string must be a str")
-    return string.encode("ascii", "replace")
+    return string.encode(CODEC_NAME, "replace")
+
+
+def restamp(frame: bytes, connection_id: int) -> bytes:
+    """
+    Change the connection id of an encoded frame
+
+    :param frame: the frame
+    :param connection_id: the new connection id
+    :return: the frame for the new connection
+    """
+    return bytes(((frame[0] & 0xf0) | connection_id,)) + frame[1:]
 
 
 def to_hex(num: Union[int, bytes]) -> str:
@@ -43,17 +59,9 @@ def hexdump(data: bytes, show_binary: bool = False) -> str:
     if not isinstance(data, bytes):
         raise ValueError("data must be a bytes object")
 
-    ascii_data = []
-    for byte in data:
-        # if printable ascii
-        if 32 <= byte <= 127:
-            ascii_data.append(chr(byte))
-        else:
-            ascii_data.append(".")
-
     hex_data = [to_hex(b) for b in data]
     output = "(%s)" % " ".join(hex_data + [".."] * (8 - len(hex_data)))
-    output += " (%s)" % "".join(ascii_data)
+    output += " (%s)" % data.translate(_HEXDUMP_TABLE).decode("latin-1")
 
     if show_binary:
         binary_data = []
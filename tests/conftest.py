@@ -0,0 +1,148 @@
+from collections import deque
+from concurrent.futures import wait
+
+import pytest
+
+import mx240a.driver
+from mx240a import DEFAULT_TONES
+from mx240a.base import BaseDisconnectedError
+from mx240a.connection import HandheldManager, Service, HandheldConnectData
+from mx240a.driver import Driver
+from mx240a.handheld import Handheld
+from mx240a.packets import Packet
+
+
+class RecordingDriver:
+    """Stands in for Driver, records the packets a handheld sends"""
+    service = None
+
+    def __init__(self):
+        self.sent = []
+
+    def send_packet(self, packet, result=None):
+        self.sent.append(packet)
+
+    def send_packets(self, connection_id, packets, result=None):
+        self.sent.extend(packets)
+
+
+@pytest.fixture
+def driver():
+    return RecordingDriver()
+
+
+@pytest.fixture
+def handheld(driver):
+    return Handheld(driver, 1, "01020304")
+
+
+class FakeBase:
+    """
+    Stands in for Base: read() returns the frames in inbox, written frames are recorded
+
+    lose_after: number of frames written before the base is lost, None to never lose it
+    """
+
+    def __init__(self, path=None):
+        self.inbox = deque()
+        self.written = []
+        self.lose_after = None
+        self.lost = False
+        self.reopened = 0
+
+    def read(self, timeout_ms=1000):
+        if self.lost:
+            raise BaseDisconnectedError("Base lost")
+        if self.inbox:
+            return Packet.decode(bytes.fromhex(self.inbox.popleft()))
+        return None
+
+    def write(self, packet):
+        for frame in packet.encode():
+            self.write_frame(frame)
+
+    def write_frame(self, frame):
+        if self.lose_after is not None:
+            if self.lose_after == 0:
+                self.lost = True
+                self.lose_after = None
+            else:
+                self.lose_after -= 1
+        if self.lost:
+            raise BaseDisconnectedError("Base lost")
+        self.written.append(bytes(frame).hex())
+
+    def reopen(self):
+        self.lost = False
+        self.reopened += 1
+
+    def close(self):
+        pass
+
+
+class FakeManager(HandheldManager):
+    def __init__(self):
+        self.tones = {"new_message": DEFAULT_TONES["new_message"]}
+        self.connect_data = None
+
+    def register(self, handheld_id):
+        return True
+
+    def connect(self, handheld_id):
+        if self.connect_data is not None:
+            return self.connect_data(handheld_id)
+        data = HandheldConnectData("Test")
+        for tone_name, tone in self.tones.items():
+            setattr(data.tones, tone_name, tone)
+        return data
+
+
+class FakeService(Service):
+    def __init__(self):
+        self.messages = []
+        self.login_result = True
+
+    def login(self, handheld):
+        if callable(self.login_result):
+            return self.login_result(handheld)
+        return self.login_result
+
+    def message(self, handheld, window_id, message):
+        self.messages.append((handheld.connection_id, window_id, message))
+
+
+@pytest.fixture
+def base_driver(monkeypatch):
+    """A Driver on a FakeBase"""
+    monkeypatch.setattr(mx240a.driver, "Base", FakeBase)
+    monkeypatch.setattr(Driver, "REOPEN_BACKOFF_S", (0.0,))
+    driver = Driver(FakeManager(), FakeService())
+    yield driver
+    driver.callback_pool.shutdown()
+    for pool in driver.service_pools.values():
+        pool.shutdown()
+
+
+def _pump(driver, *frames, rounds=100):
+    """
+    Feed frames to a driver on a FakeBase and run its loop until it has nothing left to do, recovering a lost base
+
+    :return: the frames written, as hex
+    """
+    driver.base.inbox.extend(frames)
+    start = len(driver.base.written)
+    for _ in range(rounds):
+        try:
+            driver.do_one_loop()
+        except BaseDisconnectedError as e:
+            driver.recover(e)
+        wait([call.future for call in driver.pending_calls], timeout=1)
+        if not (driver.base.inbox or driver.pending_calls or driver.tone_uploads or driver.requeued
+                or not driver.outbox.empty()):
+            break
+    return driver.base.written[start:]
+
+
+@pytest.fixture
+def pump():
+    return _pump
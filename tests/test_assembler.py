@@ -0,0 +1,50 @@
+from mx240a.assembler import MessageAssembler
+from mx240a.packets import MessagePacket
+
+
+def fragment(connection_id: int, window_id: int, data: bytes, final: bool = True) -> MessagePacket:
+    return MessagePacket(bytes([0xf0 | connection_id, window_id]) + data + (b"" if final else b"\xfe"))
+
+
+def test_single_fragment_message():
+    assert MessageAssembler().feed(fragment(1, 5, b"hello"), 0) == b"hello"
+
+
+def test_fragments_are_joined():
+    assembler = MessageAssembler()
+    assert assembler.feed(fragment(1, 5, b"hello ", final=False), 0) is None
+    assert assembler.feed(fragment(1, 5, b"world"), 0) == b"hello world"
+
+
+def test_connections_and_windows_do_not_mix():
+    assembler = MessageAssembler()
+    assembler.feed(fragment(1, 5, b"one ", final=False), 0)
+    assembler.feed(fragment(2, 5, b"two ", final=False), 0)
+    assembler.feed(fragment(1, 6, b"three ", final=False), 0)
+    assert assembler.feed(fragment(2, 5, b"b"), 0) == b"two b"
+    assert assembler.feed(fragment(1, 5, b"a"), 0) == b"one a"
+    assert assembler.feed(fragment(1, 6, b"c"), 0) == b"three c"
+
+
+def test_oversized_message_is_dropped_and_buffer_reused():
+    assembler = MessageAssembler(max_size=8)
+    assembler.feed(fragment(1, 5, b"x" * 6, final=False), 0)
+    assert assembler.feed(fragment(1, 5, b"x" * 6), 0) is None
+    assert assembler.feed(fragment(1, 5, b"short"), 0) == b"short"
+    assert len(assembler._free_buffers) == 1
+
+
+def test_expire_drops_stale_partials():
+    assembler = MessageAssembler(timeout=1)
+    assembler.feed(fragment(1, 5, b"old ", final=False), 0)
+    assembler.feed(fragment(2, 5, b"new ", final=False), 5)
+    assembler.expire(5.5)
+    assert assembler.feed(fragment(1, 5, b"end"), 6) == b"end"
+    assert assembler.feed(fragment(2, 5, b"end"), 6) == b"new end"
+
+
+def test_drop_connection():
+    assembler = MessageAssembler()
+    assembler.feed(fragment(1, 5, b"gone ", final=False), 0)
+    assembler.drop_connection(1)
+    assert assembler.feed(fragment(1, 5, b"fresh"), 0) == b"fresh"
@@ -0,0 +1,54 @@
+import string
+
+import pytest
+
+from mx240a.charset import CODEC_NAME
+from mx240a.translit import transliterate
+
+
+def test_printable_ascii_round_trips():
+    text = "".join(chr(c) for c in range(0x20, 0x7f))
+    assert text.encode(CODEC_NAME).decode(CODEC_NAME) == text
+
+
+def test_low_bytes_decode_to_handheld_glyphs():
+    assert bytes([0x00, 0x01, 0x1a]).decode(CODEC_NAME) == "`az"
+
+
+def test_line_feed_round_trips():
+    assert b"\x0a".decode(CODEC_NAME) == "\n"
+    assert "a\nb".encode(CODEC_NAME).decode(CODEC_NAME) == "a\nb"
+
+
+@pytest.mark.parametrize("glyph", ["↑", "↓", "◣", "◢"])
+def test_username_glyphs_are_not_encoded_as_punctuation(glyph):
+    with pytest.raises(UnicodeEncodeError):
+        glyph.encode(CODEC_NAME)
+    assert glyph.encode(CODEC_NAME, "replace") == b"?"
+
+
+def test_undefined_bytes_fail_to_decode():
+    with pytest.raises(UnicodeDecodeError):
+        b"\x80".decode(CODEC_NAME)
+    assert b"a\xffb".decode(CODEC_NAME, "replace") == "a�b"
+
+
+def test_transliterate_keeps_ascii():
+    assert transliterate(string.printable[:95]) == string.printable[:95]
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("café", "cafe"),
+    ("“quoted” — text…", "\"quoted\" - text..."),
+    ("← → ↑ ↓", "<- -> ^ v"),
+    ("ﬁ", "fi"),
+    ("\u200bzero\ufeff", "zero"),
+    ("😀", ":grinning_face:"),
+])
+def test_transliterate(text, expected):
+    assert transliterate(text) == expected
+
+
+def test_transliterated_text_is_encodable():
+    text = transliterate("Grüße ↑ from 東京 ◣ 😀")
+    assert text.encode(CODEC_NAME).decode(CODEC_NAME) == text
@@ -0,0 +1,182 @@
+from concurrent.futures import wait
+from threading import Event
+
+import pytest
+
+from mx240a.base import BaseDisconnectedError
+from mx240a.driver import Driver
+from mx240a.packets import ErrorPacket, HandheldConnectingPacket, Packet, RxPacket, SendMessagePacket
+
+HANDHELD_ID = "01020304"
+CONNECT = "e18e" + HANDHELD_ID
+PASSWORD = "e19270ff"
+OPEN_WINDOW = "f1940101ff"
+LOGIN_SUCCESS = "e1d3ff"
+CONNECT_2 = "e28e05060708"
+PASSWORD_2 = "e29270ff"
+OPEN_WINDOW_2 = "f2940101ff"
+LOGIN_SUCCESS_2 = "e2d3ff"
+DISCONNECT = "e18c"
+
+
+def tone_frames(driver):
+    script = driver.handshakes.get(HANDHELD_ID, 1, driver.handheld_manager.connect(HANDHELD_ID), " AIM  ")
+    return [frame.hex() for _, _, frames in script.tones for frame in frames]
+
+
+def test_tone_upload_survives_losing_the_base(base_driver, pump):
+    base = base_driver.base
+    pump(base_driver, CONNECT)
+    base.lose_after = 3
+    # login success and the first two tones make it, the base is lost writing the third
+    written = pump(base_driver, PASSWORD)
+    assert base.reopened == 1
+    assert written[0] == LOGIN_SUCCESS
+    assert 1 in base_driver.pending_tones
+
+    # the handheld comes back by talking, the upload carries on with the interrupted tone
+    written = pump(base_driver, OPEN_WINDOW)
+    assert written == tone_frames(base_driver)[2:]
+    assert not base_driver.tone_uploads and not base_driver.pending_tones
+
+
+def test_finished_callbacks_are_not_finished_again_after_recovery(base_driver, pump):
+    gate = Event()
+    base_driver.service.login_result = lambda handheld: gate.wait(5)
+    base = base_driver.base
+    pump(base_driver, CONNECT, CONNECT_2)
+    base.inbox.extend([PASSWORD, PASSWORD_2])
+    base_driver.do_one_loop()
+    base_driver.do_one_loop()
+    gate.set()
+    wait([call.future for call in base_driver.pending_calls])
+
+    # handheld 1's login success is written, the base is lost writing handheld 2's
+    base.lose_after = 1
+    with pytest.raises(BaseDisconnectedError) as info:
+        base_driver.do_one_loop()
+    assert base.written[-1] == LOGIN_SUCCESS
+    base_driver.recover(info.value)
+
+    written = pump(base_driver, OPEN_WINDOW, OPEN_WINDOW_2)
+    assert LOGIN_SUCCESS not in written
+    assert written.count(LOGIN_SUCCESS_2) == 1
+
+
+def test_unchanged_tones_are_not_uploaded_again(base_driver, pump):
+    written = pump(base_driver, CONNECT, PASSWORD)
+    assert written[-len(tone_frames(base_driver)):] == tone_frames(base_driver)
+
+    pump(base_driver, DISCONNECT)
+    written = pump(base_driver, CONNECT, PASSWORD)
+    assert written[-1] == LOGIN_SUCCESS
+    assert not set(written) & set(tone_frames(base_driver))
+
+
+def error_frames(connection_id, error_type):
+    return [frame.hex() for frame in ErrorPacket(connection_id, error_type).encode()]
+
+
+def test_login_past_its_deadline_is_answered_with_an_error(base_driver, pump, monkeypatch):
+    gate = Event()
+    base_driver.service.login_result = lambda handheld: gate.wait(5)
+    monkeypatch.setattr(Driver, "LOGIN_DEADLINE_S", -1.0)
+    pump(base_driver, CONNECT)
+    base_driver.base.inbox.append(PASSWORD)
+    base_driver.do_one_loop()
+    assert base_driver.base.written[-1:] == error_frames(1, ErrorPacket.ErrorType.ServiceTemporarilyUnavailable)
+    assert not base_driver.pending_calls
+
+    # the late result is dropped
+    gate.set()
+    assert LOGIN_SUCCESS not in pump(base_driver)
+
+
+def test_failed_login_is_answered_with_an_error(base_driver, pump):
+    def login(handheld):
+        raise RuntimeError("backend down")
+    base_driver.service.login_result = login
+    written = pump(base_driver, CONNECT, PASSWORD)
+    assert written[-1:] == error_frames(1, ErrorPacket.ErrorType.ServiceTemporarilyUnavailable)
+    assert LOGIN_SUCCESS not in written
+
+
+def test_disconnect_drops_pending_calls(base_driver, pump):
+    gate = Event()
+    base_driver.service.login_result = lambda handheld: gate.wait(5)
+    pump(base_driver, CONNECT)
+    base_driver.base.inbox.extend([PASSWORD, DISCONNECT])
+    base_driver.do_one_loop()
+    base_driver.do_one_loop()
+    assert not base_driver.pending_calls
+    assert base_driver.connections[1] is None
+
+    gate.set()
+    assert pump(base_driver) == []
+
+
+def test_messages_wait_for_the_handheld_after_losing_the_base(base_driver, pump):
+    base = base_driver.base
+    pump(base_driver, CONNECT, PASSWORD)
+    base.lost = True
+    with pytest.raises(BaseDisconnectedError) as info:
+        base_driver.do_one_loop()
+    base_driver.recover(info.value)
+    assert base.reopened == 1 and 1 in base_driver.resuming
+
+    future = base_driver.send_message(1, 1, "hi")
+    assert pump(base_driver) == []
+    assert not future.done()
+
+    # the handheld comes back by talking
+    written = pump(base_driver, OPEN_WINDOW)
+    assert written == [frame.hex() for frame in SendMessagePacket(1, 1, "hi").encode()]
+    assert future.done() and not base_driver.resuming
+
+
+def test_handhelds_that_do_not_come_back_are_dropped(base_driver, pump):
+    base = base_driver.base
+    pump(base_driver, CONNECT, PASSWORD)
+    handheld = base_driver.connections[1]
+    base.lost = True
+    with pytest.raises(BaseDisconnectedError) as info:
+        base_driver.do_one_loop()
+    base_driver.recover(info.value)
+    future = base_driver.send_message(1, 1, "hi")
+
+    base_driver.resume_deadline = 0.0
+    pump(base_driver)
+    assert not base_driver.resuming and base_driver.connections[1] is None
+    assert base_driver.last_sessions[HANDHELD_ID] is handheld
+    assert isinstance(future.exception(), RuntimeError)
+
+
+def test_subscribers_get_packets_of_subclasses(base_driver, pump):
+    received = []
+    unsubscribe = base_driver.subscribe(RxPacket, received.append)
+    pump(base_driver, CONNECT)
+    assert [type(packet) for packet in received] == [HandheldConnectingPacket]
+
+    unsubscribe()
+    pump(base_driver, PASSWORD)
+    assert len(received) == 1
+
+
+def test_failing_subscriber_does_not_stop_the_others(base_driver, pump):
+    received = []
+
+    def fail(packet):
+        raise RuntimeError("bad handler")
+    base_driver.subscribe(HandheldConnectingPacket, fail)
+    base_driver.subscribe(Packet, received.append)
+    pump(base_driver, CONNECT, PASSWORD)
+    assert len(received) == 2
+    assert LOGIN_SUCCESS in base_driver.base.written
+
+
+def test_subscriber_losing_the_base_recovers_it(base_driver, pump):
+    def lose(packet):
+        raise BaseDisconnectedError("Base lost")
+    base_driver.subscribe(HandheldConnectingPacket, lose)
+    pump(base_driver, CONNECT)
+    assert base_driver.base.reopened == 1
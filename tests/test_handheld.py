@@ -0,0 +1,90 @@
+from threading import Thread
+
+import pytest
+
+from mx240a.handheld import BuddyStatus, IdAllocator
+
+
+def entry(group, status=BuddyStatus.Active, mobile=False):
+    return group, status, mobile
+
+
+def test_id_allocator_reuses_released_ids_last():
+    ids = IdAllocator(1, 3)
+    assert [ids.allocate(), ids.allocate()] == [1, 2]
+    ids.release(1)
+    assert ids.allocate() == 3
+    assert ids.allocate() == 1
+
+
+def test_id_allocator_take():
+    ids = IdAllocator(1, 3)
+    assert ids.take(2) == 2
+    assert [ids.allocate(), ids.allocate()] == [1, 3]
+
+
+def test_sync_only_sends_changes(handheld, driver):
+    handheld.sync_buddy_list({"a": entry("G"), "b": entry("G")})
+    driver.sent.clear()
+    handheld.sync_buddy_list({"a": entry("G"), "b": entry("G", BuddyStatus.Away)})
+    assert [(p.buddy_id, p.status) for p in driver.sent] == [(2, BuddyStatus.Away)]
+
+
+def test_sync_group_change_keeps_buddy_id(handheld, driver):
+    handheld.sync_buddy_list({"a": entry("G"), "b": entry("G")})
+    driver.sent.clear()
+    handheld.sync_buddy_list({"a": entry("H"), "b": entry("G")})
+    assert handheld.buddies_by_name["a"].buddy_id == 1
+    assert [(p.buddy_id, p.group) for p in driver.sent] == [(1, "H")]
+    assert set(handheld.groups) == {"G", "H"}
+
+
+def test_sync_new_buddies_replace_removed_ones(handheld, driver):
+    handheld.sync_buddy_list({"a": entry("G"), "b": entry("G"), "c": entry("G")})
+    driver.sent.clear()
+    handheld.sync_buddy_list({"b": entry("G"), "d": entry("G")})
+    assert handheld.buddies_by_name["d"].buddy_id == 1
+    assert [p.buddy_id for p in driver.sent] == [1]
+    assert sorted(handheld.buddies) == [1, 2]
+
+
+def test_remove_buddy_closes_its_window(handheld):
+    buddy = handheld.add_buddy("a", "G")
+    assert handheld.open_window(buddy.buddy_id).buddy is buddy
+    handheld.remove_buddy("a")
+    assert handheld.windows == {}
+    assert handheld.groups == {}
+
+
+def test_changes_wait_for_the_lock(handheld, driver):
+    handheld.add_buddy("a", "G")
+    driver.sent.clear()
+
+    def update_status():
+        # what the driver does for a presence update
+        with handheld.lock:
+            if handheld.find_buddy("a"):
+                handheld.set_buddy_status("a", BuddyStatus.Away, False)
+
+    with handheld.lock:
+        # a service replacing the buddy while the driver updates its status
+        updater = Thread(target=update_status)
+        updater.start()
+        updater.join(0.1)
+        assert updater.is_alive()
+        handheld.remove_buddy("a")
+        handheld.add_buddy("b", "G")
+    updater.join()
+    assert [type(p).__name__ for p in driver.sent] == ["AddBuddyPacket"]
+
+
+def test_id_allocator_take_released_id():
+    ids = IdAllocator(1, 3)
+    assert [ids.allocate(), ids.allocate()] == [1, 2]
+    ids.release(1)
+    assert ids.take(1) == 1
+    with pytest.raises(ValueError):
+        ids.take(1)
+    with pytest.raises(ValueError):
+        ids.take(4)
+    assert ids.allocate() == 3
@@ -0,0 +1,50 @@
+from mx240a.layout import Layout, word_wrap, pad_wrap
+
+
+def test_short_message_is_sent_as_is():
+    assert Layout(b"hello there").data == b"hello there"
+
+
+def test_word_that_does_not_fit_moves_to_next_line():
+    layout = Layout(b"a" * 25 + b" " + b"b" * 10)
+    assert layout.lines == ["a" * 25, "b" * 10]
+    # the line is padded up to its end, the space before the word is swallowed
+    assert layout.data == b"a" * 25 + b" " * 5 + b"b" * 10
+
+
+def test_full_line_is_not_padded():
+    assert word_wrap(b"a" * 30 + b" " + b"b", 0) == b"a" * 30 + b"b"
+
+
+def test_long_word_after_gap_at_line_end_starts_next_line():
+    layout = Layout(b"a" * 29 + b" " + b"b" * 35)
+    assert layout.lines == ["a" * 29, "b" * 30, "b" * 5]
+
+
+def test_long_word_is_broken_by_handheld():
+    layout = Layout(b"hi " + b"x" * 40)
+    assert layout.data == b"hi " + b"x" * 40
+    assert layout.lines == ["hi " + "x" * 27, "x" * 13]
+
+
+def test_line_feed_pads_rest_of_line():
+    assert Layout(b"one\ntwo").lines == ["one", "two"]
+
+
+def test_trailing_and_swallowed_spaces_are_not_sent():
+    assert Layout(b"hello   ").data == b"hello"
+
+
+def test_prefix_counts_towards_first_line():
+    layout = Layout(b"b" * 10 + b" " + b"c" * 10, prefix=b"name:" + b" " * 10)
+    assert layout.lines == ["name:" + " " * 10 + "b" * 10, "c" * 10]
+
+
+def test_without_word_wrap_words_are_broken():
+    layout = Layout(b"a" * 25 + b" " + b"b" * 10, wrap_words=False)
+    assert layout.data == b"a" * 25 + b" " + b"b" * 10
+
+
+def test_pad_wrap_matches_original_driver():
+    assert pad_wrap(b"a" * 31, 0) == b"a" * 31
+    assert pad_wrap(b"ab\ncd", 0) == b"ab" + b" " * 28 + b"\ncd"
@@ -0,0 +1,48 @@
+from mx240a.handheld import BuddyStatus
+from mx240a.presence import PresenceDebouncer
+
+
+def test_update_is_due_after_window():
+    presence = PresenceDebouncer(window=3, rate=1, burst=4)
+    presence.update(1, "a", BuddyStatus.Away, False, now=0)
+    assert presence.due(now=2) == []
+    assert presence.due(now=3) == [(1, "a", BuddyStatus.Away, False)]
+    assert not presence
+
+
+def test_flapping_buddy_costs_one_update_with_last_status():
+    presence = PresenceDebouncer(window=3, rate=1, burst=4)
+    presence.update(1, "a", BuddyStatus.Away, False, now=0)
+    presence.update(1, "a", BuddyStatus.Active, False, now=1)
+    presence.update(1, "a", BuddyStatus.Idle, True, now=2.9)
+    # the window starts at the first change, constant flapping still gets through
+    assert presence.due(now=3) == [(1, "a", BuddyStatus.Idle, True)]
+
+
+def test_rate_limit_per_connection():
+    presence = PresenceDebouncer(window=0, rate=0.5, burst=2)
+    for name in "abc":
+        presence.update(1, name, BuddyStatus.Away, False, now=0)
+    presence.update(2, "x", BuddyStatus.Away, False, now=0)
+
+    assert [(c, n) for c, n, _, _ in presence.due(now=0)] == [(1, "a"), (1, "b"), (2, "x")]
+    assert presence.due(now=1) == []
+    assert [n for _, n, _, _ in presence.due(now=2)] == ["c"]
+
+
+def test_refund_gives_back_a_token():
+    presence = PresenceDebouncer(window=0, rate=0, burst=1)
+    presence.update(1, "a", BuddyStatus.Away, False, now=0)
+    presence.update(1, "b", BuddyStatus.Away, False, now=0)
+    assert len(presence.due(now=0)) == 1
+    assert presence.due(now=0) == []
+    presence.refund(1)
+    assert [n for _, n, _, _ in presence.due(now=0)] == ["b"]
+
+
+def test_drop_connection_forgets_pending():
+    presence = PresenceDebouncer(window=0)
+    presence.update(1, "a", BuddyStatus.Away, False, now=0)
+    presence.drop_connection(1)
+    assert presence.due(now=10) == []
+    assert not presence
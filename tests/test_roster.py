@@ -0,0 +1,87 @@
+import pytest
+
+from mx240a.handheld import BuddyStatus, Handheld
+from mx240a.roster import VirtualRoster
+
+
+@pytest.fixture
+def roster(handheld):
+    roster = VirtualRoster(handheld, capacity=2)
+    for i in range(5):
+        roster.set_contact(f"c{i}", "G")
+    return roster
+
+
+def test_contacts_are_added_when_used(roster, driver):
+    assert driver.sent == []
+    roster.touch("c0")
+    assert [p.screen_name for p in driver.sent] == ["c0"]
+    assert "c0" in roster
+
+
+def test_eviction_reuses_the_evicted_buddy_id(roster, handheld, driver):
+    for i in range(5):
+        roster.touch(f"c{i}")
+    assert {p.buddy_id for p in driver.sent} == {1, 2}
+    assert sorted(b.screen_name for b in handheld.buddies.values()) == ["c3", "c4"]
+
+
+def test_least_recently_used_is_evicted(roster, handheld):
+    roster.touch("c0")
+    roster.touch("c1")
+    roster.touch("c0")
+    roster.touch("c2")
+    assert "c1" not in roster
+    assert handheld.buddies_by_name["c2"].buddy_id == 2
+
+
+def test_pinned_contacts_are_not_evicted(roster):
+    roster.pin("c0")
+    for i in range(1, 5):
+        roster.touch(f"c{i}")
+    assert "c0" in roster and "c4" in roster
+    assert len(roster) == 2
+
+
+def test_set_contact_sends_changes_of_contact_on_handheld(roster, handheld, driver):
+    roster.touch("c0")
+    driver.sent.clear()
+    roster.set_contact("c0", "G", BuddyStatus.Away)
+    roster.set_contact("c0", "H", BuddyStatus.Away)
+    assert [(p.buddy_id, p.group, p.status) for p in driver.sent] == [
+        (1, "G", BuddyStatus.Away), (1, "H", BuddyStatus.Away)]
+    assert set(handheld.groups) == {"H"}
+
+
+def test_set_contact_off_handheld_sends_nothing(roster, driver):
+    roster.set_contact("c0", "H", BuddyStatus.Away)
+    assert driver.sent == []
+
+
+def test_roster_adopts_buddies_of_previous_session(driver):
+    previous = Handheld(driver, 1, "01020304")
+    previous.add_buddy("c0", "G")
+    previous.add_buddy("old", "G")
+    handheld = Handheld(driver, 2, "01020304")
+    handheld.adopt_buddy_list(previous)
+    driver.sent.clear()
+
+    roster = VirtualRoster(handheld, capacity=2)
+    roster.set_contact("c0", "G")
+    roster.set_contact("c1", "G")
+    assert roster.touch("c0").buddy_id == 1
+    assert driver.sent == []
+
+    # "old" is the least recently used, c1 replaces it
+    assert roster.fill() == []
+    assert roster.touch("c1").buddy_id == 2
+    assert sorted(b.screen_name for b in handheld.buddies.values()) == ["c0", "c1"]
+
+
+def test_touch_takes_over_buddy_added_outside_roster(roster, handheld, driver):
+    handheld.add_buddy("c0", "X")
+    driver.sent.clear()
+    buddy = roster.touch("c0")
+    assert (buddy.buddy_id, buddy.group) == (1, "G")
+    assert [(p.buddy_id, p.group) for p in driver.sent] == [(1, "G")]
+    assert len(roster) == 1
@@ -0,0 +1,63 @@
+import pytest
+
+from mx240a.rtttl import Ringtone, RTTTLError, DEFAULT_TONES, TONE_UNIT_MS, scan, optimize_tone
+
+
+@pytest.mark.parametrize("tone_name", sorted(DEFAULT_TONES))
+def test_scan_matches_pre_encoded_default_tones(tone_name):
+    tone = DEFAULT_TONES[tone_name]
+    result = scan(tone.tone_data)
+    assert result.errors == []
+    assert result.tone_bytes == tone.tone_bytes
+
+
+def test_scan_defaults_and_modifiers():
+    # 60 bpm quarter note is 1000ms, dotted 1500ms
+    result = scan("t:d=4,o=5,b=60:c,8d#6,c.,p")
+    assert result.name == "t"
+    assert result.tone_bytes == bytes([62, 0x0d, 31, 0x24, 93, 0x0d, 62, 0x7f])
+    assert (result.note_count, result.pause_count) == (4, 1)
+    assert result.duration_ms == (62 + 31 + 93 + 62) * TONE_UNIT_MS
+
+
+def test_scan_collects_every_error():
+    result = scan("t:d=3,o=5,b=120:c,x,64e,c9")
+    positions = [position for position, _ in result.errors]
+    assert len(result.errors) == 4
+    assert positions == sorted(positions)
+
+
+def test_scan_without_notes_section():
+    assert scan("no colon").errors
+    assert scan("t:d=4").errors
+
+
+def test_ringtone_raises_on_invalid_rtttl():
+    with pytest.raises(RTTTLError) as info:
+        Ringtone("t:d=4,o=5,b=120:c,x")
+    assert len(info.value.errors) == 1
+
+
+def test_optimize_merges_rests():
+    assert optimize_tone(bytes([4, 0x7f, 4, 0x7f, 4, 0x28])).tone_bytes == bytes([8, 0x7f, 4, 0x28])
+
+
+def test_optimize_keeps_repeated_notes_by_default():
+    tone = bytes([4, 0x28, 4, 0x28])
+    assert optimize_tone(tone).tone_bytes == tone
+    merged = optimize_tone(tone, merge_notes=True)
+    assert merged.tone_bytes == bytes([8, 0x28])
+    assert merged.merged_notes == 1
+
+
+def test_optimize_does_not_overflow_a_length():
+    tone = bytes([200, 0x7f, 100, 0x7f])
+    assert optimize_tone(tone).tone_bytes == tone
+
+
+def test_optimize_cuts_at_max_bytes():
+    optimized = optimize_tone(bytes([1, 0x01, 2, 0x02, 3, 0x03]), max_bytes=5)
+    assert optimized.tone_bytes == bytes([1, 0x01, 2, 0x02])
+    assert optimized.dropped_notes == 1
+    assert optimized.dropped_ms == 3 * TONE_UNIT_MS
+    assert optimized.fidelity == pytest.approx(0.5)
@@ -0,0 +1,61 @@
+from types import SimpleNamespace
+
+import pytest
+
+from mx240a.packets import Packet, UnknownPacket, HandheldConnectingPacket, HandheldUsernamePacket, \
+    OpenWindowPacket, ErrorPacket, CreateRoomPacket
+from mx240a.schema import Schema, Connection, Opcode, Byte, Text, Hex, Data, Terminator
+
+
+def test_encode_merges_single_bytes():
+    schema = Schema(Connection(0xe0), Opcode(0xc9), Byte("room_id", 0x81, 0x8f), Terminator())
+    assert schema.encode(connection_id=2, room_id=0x81) == b"\xe2\xc9\x81\xff"
+
+
+def test_encode_validates_fields():
+    schema = Schema(Connection(0xe0), Byte("value", 0x01, 0x02), Text("name", max_length=3), Terminator())
+    with pytest.raises(ValueError):
+        schema.encode(connection_id=0, value=1, name="a")
+    with pytest.raises(ValueError):
+        schema.encode(connection_id=1, value=3, name="a")
+    with pytest.raises(ValueError):
+        schema.encode(connection_id=1, value=1, name="abcd")
+
+
+def test_fixed_length_text_is_padded_and_cut():
+    schema = Schema(Opcode(0xc0), Text("group", 6), Terminator())
+    assert schema.encode(group="abc") == b"\xc0abc   \xff"
+    assert schema.encode(group="abcdefgh") == b"\xc0abcdef\xff"
+
+
+def test_decode_round_trips():
+    schema = Schema(Connection(0xf0), Hex("handheld_id", 2), Data("data"), Terminator())
+    packet = SimpleNamespace()
+    schema.decode(packet, schema.encode(connection_id=3, handheld_id="beef", data=b"xyz"))
+    assert (packet.connection_id, packet.handheld_id, packet.data) == (3, "beef", b"xyz")
+
+
+def test_only_last_field_may_be_variable():
+    with pytest.raises(ValueError):
+        Schema(Data("a"), Byte("b"), Terminator())
+
+
+def test_packets_match_their_wire_format():
+    assert next(ErrorPacket(1, ErrorPacket.ErrorType.ErrorConnectingToService).encode()) == b"\xe1\xe5\x07\xff"
+    assert next(CreateRoomPacket(3, 0x8f).encode()) == b"\xe3\xc9\x8f\xff"
+
+
+@pytest.mark.parametrize("raw, packet_type", [
+    (b"\xe1\x8e\x01\x02\x03\x04", HandheldConnectingPacket),
+    (b"\xe2\x91ab\xff", HandheldUsernamePacket),
+    (b"\xf1\x94\x05\xff", OpenWindowPacket),
+])
+def test_decode_dispatches_on_opcode(raw, packet_type):
+    assert isinstance(Packet.decode(raw), packet_type)
+
+
+@pytest.mark.parametrize("raw", [b"\xe1\x8e\x01", b"\xf1\x94", b"\xe1"])
+def test_short_frames_decode_as_unknown(raw):
+    packet = Packet.decode(raw)
+    assert isinstance(packet, UnknownPacket)
+    assert packet.raw_data == raw
@@ -0,0 +1,39 @@
+import random
+
+import pytest
+
+from mx240a.packets import SendMessagePacket
+
+
+def test_encode_for_matches_encoding_each_recipient():
+    rng = random.Random(240)
+    for _ in range(500):
+        text = "".join(rng.choice("ab cdé\n:xyz ") for _ in range(rng.randint(0, 120)))
+        username = rng.choice([None, "bob", "al:ice"])
+        window_id = rng.choice([0x01, 0x05, 0x80, 0x81, 0x8f])
+        if window_id <= 0x80:
+            other_window_id = rng.choice([0x01, 0x33, 0x80])
+        else:
+            other_window_id = rng.choice([0x81, 0x85])
+        other_connection_id = rng.randint(1, 7)
+
+        template = SendMessagePacket(rng.randint(1, 7), window_id, text, username)
+        expected = list(SendMessagePacket(other_connection_id, other_window_id, text, username).encode())
+        assert template.encode_for(other_connection_id, other_window_id) == expected, (text, username)
+
+
+def test_encode_for_rejects_other_window_kind():
+    buddy_message = SendMessagePacket(1, 0x01, "hi", "bob")
+    with pytest.raises(ValueError):
+        buddy_message.encode_for(1, 0x81)
+    room_message = SendMessagePacket(1, 0x81, "hi", "bob")
+    with pytest.raises(ValueError):
+        room_message.encode_for(1, 0x01)
+
+
+def test_frames_carry_connection_and_window():
+    packet = SendMessagePacket(3, 0x02, "x" * 60, "bob")
+    frames = list(packet.encode())
+    assert all(frame[:2] == b"\x83\x02" for frame in frames[:-1])
+    assert frames[-1] == b"\xe3\xce\x02"
+    assert b"".join(frame[2:] for frame in frames[:-1]).endswith(packet.layout.data + b"\xff")